@@ -0,0 +1,244 @@
+"""
+Stand-in ComfyUI server for benchmarking generate.py without a GPU.
+
+Speaks the parts of the ComfyUI API that generate.py uses: POST /prompt,
+GET /history/<prompt_id>, /view, /queue and the /ws event stream
+(status, execution_start, executing, executed, and binary image frames for
+SaveImageWebsocket nodes). Each prompt "renders" for --latency seconds on one
+of --workers simulated GPUs and produces a PNG of --image-size per batch item.
+
+Usage:
+    python benchmark/fake_comfyui.py --port 8188 --latency 0.5 --workers 1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import queue
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+def make_png(width, height, seed, text=None):
+    """
+    Encodes a noise PNG, so payload sizes resemble real renders rather than compressing to nothing.
+    
+    The pixels follow from `seed`, so the same inputs render the same image. `text`
+    is embedded as a tEXt chunk, the way SaveImage embeds the prompt JSON.
+    """
+    rng = random.Random(seed)
+    row_size = width * 3
+    raw = b"".join(b"\x00" + rng.randbytes(row_size) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + (png_chunk(b"tEXt", b"prompt\0" + text.encode()) if text is not None else b"")
+            + png_chunk(b"IDAT", zlib.compress(raw, 1)) + png_chunk(b"IEND", b""))
+
+class FakeComfyUI:
+    """Queue, history and websocket clients of the stand-in server."""
+
+    def __init__(self, latency, jitter, workers, image_size):
+        self.latency = latency
+        self.jitter = jitter
+        self.image_size = image_size
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue()
+        self.pending = []
+        self.running = []
+        self.history = {}
+        self.files = {}
+        self.clients = {}
+        self.prompts_done = 0
+        for n in range(workers):
+            threading.Thread(target=self._worker, name=f"gpu-{n}", daemon=True).start()
+
+    def send(self, client_id, payload, binary=False):
+        with self.lock:
+            client = self.clients.get(client_id)
+        if client is None:
+            return
+        sock, send_lock = client
+        data = payload if binary else json.dumps(payload).encode()
+        opcode = 0x82 if binary else 0x81
+        if len(data) < 126:
+            header = struct.pack(">BB", opcode, len(data))
+        elif len(data) < 65536:
+            header = struct.pack(">BBH", opcode, 126, len(data))
+        else:
+            header = struct.pack(">BBQ", opcode, 127, len(data))
+        try:
+            with send_lock:
+                sock.sendall(header + data)
+        except OSError:
+            pass
+
+    def render_png(self, workflow, n):
+        # Like a real render, the pixels depend on the inputs (prompt, seed, size, batch index) but not on the
+        # filename prefix, while the embedded prompt JSON, prefix included, differs for every job
+        inputs = {node_id: {key: value for key, value in node.get("inputs", {}).items() if key != "filename_prefix"}
+                  for node_id, node in workflow.items() if isinstance(node, dict)}
+        seed = hashlib.sha256(json.dumps([inputs, n], sort_keys=True).encode()).hexdigest()
+        return make_png(*self.image_size, seed, json.dumps(workflow))
+
+    def queue_remaining(self):
+        with self.lock:
+            return len(self.pending) + len(self.running)
+
+    def broadcast_status(self):
+        status = {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": self.queue_remaining()}}}}
+        with self.lock:
+            client_ids = list(self.clients)
+        for client_id in client_ids:
+            self.send(client_id, status)
+
+    def submit(self, client_id, workflow):
+        prompt_id = str(uuid.uuid4())
+        with self.lock:
+            self.pending.append(prompt_id)
+        self.jobs.put((prompt_id, client_id, workflow))
+        self.broadcast_status()
+        return prompt_id
+
+    def _worker(self):
+        while True:
+            prompt_id, client_id, workflow = self.jobs.get()
+            with self.lock:
+                self.pending.remove(prompt_id)
+                self.running.append(prompt_id)
+            self.send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+            batch_size = 1
+            for node in workflow.values():
+                # EmptyLatentImage, EmptySD3LatentImage, ...
+                if "Latent" in node.get("class_type", "") and "batch_size" in node.get("inputs", {}):
+                    batch_size = int(node["inputs"]["batch_size"])
+            first_node = next(iter(workflow), None)
+            self.send(client_id, {"type": "executing", "data": {"node": first_node, "prompt_id": prompt_id}})
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+            images = []
+            for node_id, node in workflow.items():
+                if node.get("class_type") == "SaveImageWebsocket":
+                    self.send(client_id, {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+                    for n in range(batch_size):
+                        # Event type 1 (preview image), format 2 (PNG), then the image bytes
+                        self.send(client_id, struct.pack(">II", 1, 2) + self.render_png(workflow, n), binary=True)
+                elif node.get("class_type") == "SaveImage":
+                    prefix = node.get("inputs", {}).get("filename_prefix", "ComfyUI")
+                    for n in range(batch_size):
+                        filename = f"{prefix}_{n+1:05d}_.png"
+                        with self.lock:
+                            self.files[filename] = self.render_png(workflow, n)
+                        images.append({"filename": filename, "subfolder": "", "type": "output"})
+                    self.send(client_id, {"type": "executed", "data": {"node": node_id, "prompt_id": prompt_id,
+                                                                       "output": {"images": images}}})
+
+            with self.lock:
+                self.history[prompt_id] = {"outputs": {"9": {"images": images}} if images else {},
+                                           "status": {"status_str": "success", "completed": True}}
+                self.running.remove(prompt_id)
+                self.prompts_done += 1
+            self.send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+            self.broadcast_status()
+
+def make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, body, content_type="application/json", status=200):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if urlparse(self.path).path != "/prompt" or not isinstance(body.get("prompt"), dict):
+                return self.reply({"error": "invalid prompt"}, status=400)
+            prompt_id = server.submit(body.get("client_id"), body["prompt"])
+            self.reply({"prompt_id": prompt_id, "number": server.prompts_done, "node_errors": {}})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/ws":
+                return self.websocket(parse_qs(url.query).get("clientId", [""])[0])
+            if url.path.startswith("/history/"):
+                prompt_id = url.path.rsplit("/", 1)[-1]
+                with server.lock:
+                    entry = server.history.get(prompt_id)
+                return self.reply({prompt_id: entry} if entry else {})
+            if url.path == "/view":
+                with server.lock:
+                    image = server.files.get(parse_qs(url.query).get("filename", [""])[0])
+                if image is None:
+                    return self.reply({"error": "not found"}, status=404)
+                return self.reply(image, "image/png")
+            if url.path == "/queue":
+                with server.lock:
+                    return self.reply({"queue_running": [[0, p] for p in server.running],
+                                       "queue_pending": [[0, p] for p in server.pending]})
+            self.reply({"error": "not found"}, status=404)
+
+        def websocket(self, client_id):
+            accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID).encode()).digest())
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept.decode())
+            self.end_headers()
+            self.wfile.flush()
+            with server.lock:
+                server.clients[client_id] = (self.connection, threading.Lock())
+            server.send(client_id, {"type": "status", "data": {"status": {"exec_info": {
+                "queue_remaining": server.queue_remaining()}}, "sid": client_id}})
+            try:
+                # Client frames (pings, close) are not interpreted; the socket closing ends the session
+                while self.connection.recv(1024):
+                    pass
+            except OSError:
+                pass
+            with server.lock:
+                server.clients.pop(client_id, None)
+            self.close_connection = True
+
+    return Handler
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in ComfyUI server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds each prompt takes to render (default: 0.5)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency")
+    parser.add_argument("--workers", type=int, default=1, help="Prompts rendered at the same time (default: 1)")
+    parser.add_argument("--image-size", type=parse_size, default=(512, 512), help="Size of the returned PNGs (default: 512x512)")
+    args = parser.parse_args()
+
+    server = FakeComfyUI(args.latency, args.jitter, args.workers, args.image_size)
+    httpd = ThreadingHTTPServer((args.host, args.port), make_handler(server))
+    httpd.daemon_threads = True
+    print(f"Fake ComfyUI listening on {args.host}:{args.port}", flush=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Stand-in for the LM Studio SDK, for benchmarking generate.py without a GPU.
+
+generate.py talks to LM Studio through the lmstudio SDK (lms.llm(...).respond()),
+whose websocket protocol is not practical to reimplement. This launcher replaces
+lmstudio.llm in-process with a model that answers after a configurable
+time-to-first-token plus a per-token delay, then runs generate.py with the
+remaining arguments.
+
+Usage:
+    python benchmark/fake_lmstudio.py --token-latency 0.01 --tokens 40 -- -n 10 -c bench --pipeline
+"""
+import argparse
+import os
+import random
+import re
+import runpy
+import sys
+import threading
+import time
+import types
+
+import lmstudio
+
+WORDS = ("soft", "morning", "light", "warm", "tones", "wooden", "table", "linen", "shadow", "window", "plant",
+         "ceramic", "mug", "steam", "quiet", "kitchen", "neutral", "palette", "close", "detail", "texture",
+         "afternoon", "sunlit", "balcony", "city", "view", "calm", "portrait", "candid", "natural")
+
+class FakeModel:
+    """Answers prompt requests like an LM Studio model handle, with simulated generation time."""
+
+    def __init__(self, first_token_latency, token_latency, tokens, concurrency):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.tokens = tokens
+        # A local model serves a limited number of requests at once
+        self._slots = threading.Semaphore(concurrency)
+
+    def _text(self):
+        return ", ".join(random.choice(WORDS) for _ in range(self.tokens))
+
+    def respond(self, prompt, response_format=None):
+        # Batched requests list their tag sets as "1. tags", "2. tags", ...
+        entries = re.findall(r"^(\d+)\. ", prompt, re.MULTILINE)
+        with self._slots:
+            time.sleep(self.first_token_latency + self.token_latency * self.tokens * max(1, len(entries)))
+        if entries and "prompts" in getattr(response_format, "model_fields", {}):
+            return types.SimpleNamespace(parsed={"prompts": [{"index": int(n), "prompt": self._text()} for n in entries]})
+        return types.SimpleNamespace(parsed={"prompt": self._text()})
+
+    def unload(self):
+        pass
+
+def install(first_token_latency=0.05, token_latency=0.01, tokens=40, concurrency=1):
+    """Replaces lmstudio.llm so every model load returns a FakeModel."""
+    lmstudio.llm = lambda *args, **kwargs: FakeModel(first_token_latency, token_latency, tokens, concurrency)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run generate.py against a stand-in LM Studio model",
+                                     usage="%(prog)s [options] -- GENERATE_ARGS...")
+    parser.add_argument("--first-token-latency", type=float, default=0.05, help="Seconds before the first token (default: 0.05)")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds per generated token (default: 0.01)")
+    parser.add_argument("--tokens", type=int, default=40, help="Tokens per prompt (default: 40)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Requests the model serves at once (default: 1)")
+    parser.add_argument("--generate", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "generate.py"),
+                        help="Path to generate.py")
+    argv = sys.argv[1:]
+    generate_args = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, generate_args = argv[:split], argv[split + 1:]
+    args = parser.parse_args(argv)
+
+    install(args.first_token_latency, args.token_latency, args.tokens, args.concurrency)
+    sys.argv = [args.generate] + generate_args
+    runpy.run_path(args.generate, run_name="__main__")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+End-to-end throughput benchmark for generate.py using local stand-in services.
+
+Starts benchmark/fake_comfyui.py, then runs generate.py through
+benchmark/fake_lmstudio.py for every combination of job count, in-flight
+setting and mode. Each run happens in a scratch directory holding a copy of a
+config and the workflows. Images per second are taken from the run's timing
+summary (written with --metrics). With --baseline, results are compared against
+an earlier --output file and the script exits with status 1 when any setting
+got slower by more than --tolerance.
+
+Usage:
+    python benchmark/run_benchmark.py --jobs 10 50 --in-flight 1 4 --output bench.json
+    python benchmark/run_benchmark.py --jobs 10 50 --in-flight 1 4 --baseline bench.json
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def prepare_workdir(workdir, config_name, port):
+    """Copies a config (pointed at the fake ComfyUI) and the workflows into a scratch directory."""
+    with open(os.path.join(REPO_DIR, "configs", f"{config_name}.yaml"), 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    config.setdefault('comfy_ui', {})
+    config['comfy_ui'].pop('servers', None)
+    config['comfy_ui']['server_address'] = f"127.0.0.1:{port}"
+    config.setdefault('lm_studio', {})['prompt_cache'] = "off"
+    os.makedirs(os.path.join(workdir, "configs"))
+    with open(os.path.join(workdir, "configs", "bench.yaml"), 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, sort_keys=False, allow_unicode=True)
+    shutil.copytree(os.path.join(REPO_DIR, "workflows"), os.path.join(workdir, "workflows"),
+                    ignore=shutil.ignore_patterns(".cache"))
+
+def read_metrics(path):
+    """Parses the unlabelled-by-stage values of a Prometheus text file written by generate.py --metrics."""
+    values = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            match = re.match(r'^(imginarium_images_total|imginarium_images_per_minute)\{[^}]*\} (\S+)$', line.strip())
+            if match:
+                values[match.group(1)] = float(match.group(2))
+    return values
+
+def run_case(args, workdir, num_jobs, in_flight, mode):
+    metrics_path = os.path.join(workdir, "metrics.prom")
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    command = [sys.executable, os.path.join(BENCHMARK_DIR, "fake_lmstudio.py"),
+               "--token-latency", str(args.token_latency), "--tokens", str(args.tokens),
+               "--concurrency", str(args.llm_concurrency),
+               "--generate", os.path.join(REPO_DIR, "generate.py"), "--",
+               "-n", str(num_jobs), "-c", "bench", "--in-flight", str(in_flight),
+               "--llm-concurrency", str(args.llm_concurrency), "--noemoji", "--metrics", metrics_path]
+    if args.workflow:
+        command += ["-w", args.workflow]
+    if mode == "pipeline":
+        command.append("--pipeline")
+    if args.ws_images:
+        command.append("--ws-images")
+
+    started = time.time()
+    result = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+    wall_time = time.time() - started
+    if result.returncode != 0 or not os.path.exists(metrics_path):
+        sys.stderr.write(result.stdout[-2000:] + result.stderr[-2000:])
+        return {"jobs": num_jobs, "in_flight": in_flight, "mode": mode, "error": f"exit status {result.returncode}"}
+
+    metrics = read_metrics(metrics_path)
+    return {
+        "jobs": num_jobs,
+        "in_flight": in_flight,
+        "mode": mode,
+        "images": int(metrics.get('imginarium_images_total', 0)),
+        "images_per_second": round(metrics.get('imginarium_images_per_minute', 0.0) / 60, 3),
+        "wall_time": round(wall_time, 2),
+    }
+
+def case_key(result):
+    return f"{result['mode']}/jobs={result['jobs']}/in_flight={result['in_flight']}"
+
+def compare(results, baseline_path, tolerance):
+    """Prints each case's change against the baseline and returns the keys that regressed."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {case_key(result): result for result in json.load(f)['results'] if 'error' not in result}
+    regressions = []
+    for result in results:
+        before = baseline.get(case_key(result))
+        if before is None or 'error' in result or not before['images_per_second']:
+            continue
+        change = result['images_per_second'] / before['images_per_second'] - 1
+        flag = "REGRESSION" if change < -tolerance else ""
+        print(f"{case_key(result):<40} {before['images_per_second']:>8.2f} -> {result['images_per_second']:>8.2f} "
+              f"img/s ({change:+.0%}) {flag}")
+        if flag:
+            regressions.append(case_key(result))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end generate.py throughput benchmark")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10, 50], help="Job counts to run (default: 10 50)")
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[1, 4], help="--in-flight settings to run (default: 1 4)")
+    parser.add_argument("--modes", nargs="+", choices=["pipeline", "staged"], default=["pipeline", "staged"])
+    parser.add_argument("--config", default="stock", help="Config whose tags and LM settings are used (default: stock)")
+    parser.add_argument("--workflow", default="flux_dev", help="Workflow to render (default: flux_dev)")
+    parser.add_argument("--ws-images", action="store_true", help="Deliver images over the websocket")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake ComfyUI seconds per prompt (default: 0.2)")
+    parser.add_argument("--workers", type=int, default=2, help="Fake ComfyUI prompts rendered at once (default: 2)")
+    parser.add_argument("--image-size", default="512x512", help="Fake ComfyUI image size (default: 512x512)")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Fake LLM seconds per token (default: 0.002)")
+    parser.add_argument("--tokens", type=int, default=40, help="Fake LLM tokens per prompt (default: 40)")
+    parser.add_argument("--llm-concurrency", type=int, default=1, help="Parallel LLM requests (default: 1)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown against the baseline (default: 0.15)")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, "fake_comfyui.py"), "--port", str(port),
+                               "--latency", str(args.latency), "--workers", str(args.workers),
+                               "--image-size", args.image_size], stdout=subprocess.DEVNULL)
+    results = []
+    try:
+        if not wait_for_port(port):
+            sys.exit("Fake ComfyUI server did not start")
+        with tempfile.TemporaryDirectory(prefix="imginarium-bench-") as workdir:
+            prepare_workdir(workdir, args.config, port)
+            print(f"{'case':<40} {'images':>7} {'img/s':>8} {'wall s':>8}")
+            for mode, num_jobs, in_flight in itertools.product(args.modes, args.jobs, args.in_flight):
+                result = run_case(args, workdir, num_jobs, in_flight, mode)
+                results.append(result)
+                if 'error' in result:
+                    print(f"{case_key(result):<40} failed: {result['error']}")
+                else:
+                    print(f"{case_key(result):<40} {result['images']:>7} {result['images_per_second']:>8.2f} "
+                          f"{result['wall_time']:>8.1f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'tolerance')}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    failed = [result for result in results if 'error' in result]
+    regressions = compare(results, args.baseline, args.tolerance) if args.baseline else []
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,35 @@ import argparse
 import yaml
 import random
 import uuid
+import io
 import os
 import json
+import math
 import time
+import queue
+import asyncio
+import threading
+import multiprocessing
+import re
+import copy
+import itertools
+import hashlib
+import sqlite3
+import struct
+import zlib
 import requests
 import websocket
-from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import lmstudio as lms
 from pydantic import BaseModel
-from PIL import Image, PngImagePlugin
+from PIL import Image
 import sys
 from datetime import datetime
+from typing import List
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_for_futures
+from concurrent.futures.process import BrokenProcessPool
 
 # Global flag for emoji usage
 USE_EMOJIS = True
@@ -23,6 +41,13 @@ def set_emoji_mode(disable_emojis=False):
     if disable_emojis:
         USE_EMOJIS = False
 
+# Global flag for per-item output; streaming runs print periodic progress lines instead
+QUIET = False
+
+def set_quiet_mode(quiet=True):
+    global QUIET
+    QUIET = quiet
+
 # Emoji dictionary for easy switching
 EMOJIS = {
     "sparkle": "✨",
@@ -50,6 +75,14 @@ def get_emoji(key):
 class PromptSchema(BaseModel):
     prompt: str
 
+# Schema for batched LM Studio responses: one entry per numbered tag combination
+class BatchPromptItem(BaseModel):
+    index: int
+    prompt: str
+
+class BatchPromptSchema(BaseModel):
+    prompts: List[BatchPromptItem]
+
 # --- Fancy Logging Helpers ---
 def print_header(title):
     """Print a fancy header with emojis."""
@@ -65,12 +98,16 @@ def print_subheader(title, emoji_key="tag"):
 
 def print_step(step_num, total_steps, description, emoji_key="rocket"):
     """Print a step with progress indicator."""
+    if QUIET:
+        return
     emoji_str = get_emoji(emoji_key)
     progress = f"[{step_num}/{total_steps}]"
     print(f"{emoji_str} {progress} {description}")
 
 def print_success(message, emoji_key="check"):
     """Print a success message."""
+    if QUIET:
+        return
     emoji_str = get_emoji(emoji_key)
     print(f"{emoji_str} {message}")
 
@@ -86,6 +123,8 @@ def print_error(message, emoji_key="error"):
 
 def print_info(message, emoji_key="info"):
     """Print an info message."""
+    if QUIET:
+        return
     emoji_str = get_emoji(emoji_key)
     print(f"{emoji_str} {message}")
 
@@ -127,9 +166,18 @@ def tags_to_filename(tags_str):
     
     return filename
 
+# --- Errors ---
+class GenerationError(Exception):
+    """Raised when a generation run cannot be set up or continued."""
+
 # --- Configuration Loading ---
 def load_config(config_path="configs/config.yaml"):
-    """Loads configuration from a YAML file."""
+    """
+    Loads configuration from a YAML file.
+    
+    Raises:
+        GenerationError: If the file is missing, unreadable or malformed
+    """
     try:
         print_info(f"Loading configuration from '{config_path}'...")
         with open(config_path, 'r', encoding='utf-8') as f:
@@ -149,149 +197,929 @@ def load_config(config_path="configs/config.yaml"):
         print_success("Configuration loaded successfully! 🎉")
         return config
     except FileNotFoundError:
-        print_error(f"Configuration file '{config_path}' not found.")
-        exit(1)
+        raise GenerationError(f"Configuration file '{config_path}' not found.")
     except yaml.YAMLError as e:
-        print_error(f"Error parsing configuration file: {e}")
-        exit(1)
+        raise GenerationError(f"Error parsing configuration file: {e}")
     except ValueError as e:
-        print_error(f"Error in configuration structure: {e}")
-        exit(1)
+        raise GenerationError(f"Error in configuration structure: {e}")
     except UnicodeDecodeError as e:
-        print_error(f"Encoding error in configuration file: {e}")
         print_info("Try saving the config.yaml file with UTF-8 encoding.")
-        exit(1)
+        raise GenerationError(f"Encoding error in configuration file: {e}")
 
 # --- Tag Generation ---
-def generate_tag_combinations(tags_config, num_combinations):
-    """Generates random combinations of tags from all categories."""
-    print_subheader("Generating Tag Combinations", "🏷️")
-    combinations = []
+# Categories every combination draws from, and categories that may be left out
+REQUIRED_TAG_CATEGORIES = ["subject", "action", "setting", "mood", "style"]
+OPTIONAL_TAG_CATEGORIES = ["lighting", "camera_angle"]
+TAG_SAMPLING_MODES = ["random", "unique", "stratified", "fill-gaps"]
+
+class TagSpace:
+    """
+    Mixed-radix index over every possible tag combination of a config.
+    
+    Each required category contributes one digit with one value per tag; each
+    optional category has one extra value meaning "absent". An integer in
+    range(size) therefore names exactly one combination, so the space can be
+    sampled without building the Cartesian product.
+    
+    As with random sampling, each optional category is included about half the
+    time: samplers first pick which optional categories to include, then a
+    combination among those. Omitting a category shrinks the space, so those
+    choices run out first on large draws; from then on the rate drifts towards
+    the category's share of the space.
+    """
+
+    def __init__(self, tags_config, required_categories, optional_categories):
+        self.categories = [(category, list(tags_config[category]), False) for category in required_categories]
+        self.categories += [(category, list(tags_config[category]), True) for category in optional_categories]
+        self.radices = [len(values) + (1 if optional else 0) for _, values, optional in self.categories]
+        self.size = 1
+        for radix in self.radices:
+            self.size *= radix
+
+    def digits(self, index):
+        digits = []
+        for radix in self.radices:
+            index, digit = divmod(index, radix)
+            digits.append(digit)
+        return digits
+
+    def index_of(self, digits):
+        index = 0
+        for digit, radix in zip(reversed(digits), reversed(self.radices)):
+            index = index * radix + digit
+        return index
+
+    def decode(self, index):
+        """Returns the tag string for a combination index."""
+        selected_tags = []
+        for (category, values, optional), digit in zip(self.categories, self.digits(index)):
+            if optional:
+                if digit == 0:
+                    continue
+                digit -= 1
+            selected_tags.append(f"{category}:{values[digit]}")
+        return ", ".join(selected_tags)
+
+    def encode(self, tag_string):
+        """Returns the index of a tag string, or None if it does not belong to this space."""
+        chosen = {}
+        for tag in tag_string.split(","):
+            category, _, value = tag.strip().partition(":")
+            chosen[category] = value
+        digits = []
+        for category, values, optional in self.categories:
+            value = chosen.pop(category, None)
+            if value is None:
+                if not optional:
+                    return None
+                digits.append(0)
+            elif value in values:
+                digits.append(values.index(value) + (1 if optional else 0))
+            else:
+                return None
+        return None if chosen else self.index_of(digits)
+
+    def _subspaces(self):
+        """Yields (radices, offsets) of the combinations for each include/omit choice of the optional categories."""
+        optional = [n for n, (_, _, is_optional) in enumerate(self.categories) if is_optional]
+        for mask in range(1 << len(optional)):
+            included = {n for bit, n in enumerate(optional) if mask >> bit & 1}
+            yield ([1 if n in optional and n not in included else len(values)
+                    for n, (_, values, _) in enumerate(self.categories)],
+                   [1 if n in included else 0 for n in range(len(self.categories))])
+
+    @staticmethod
+    def _iter_permutation(size):
+        """
+        Yields range(size) in pseudo-random order using constant memory: a keyed
+        Feistel permutation over the next power of four, walked until it lands
+        inside the range.
+        """
+        half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        mask = (1 << half_bits) - 1
+        keys = [random.getrandbits(64) for _ in range(4)]
+
+        def permute(x):
+            left, right = x >> half_bits, x & mask
+            for key in keys:
+                left, right = right, left ^ (hash((key, right)) & mask)
+            return (left << half_bits) | right
+
+        for counter in range(size):
+            index = permute(counter)
+            while index >= size:
+                index = permute(index)
+            yield index
+
+    def sample_unique(self, count, exclude=()):
+        """Draws up to count distinct indices, skipping those in exclude."""
+        exclude = set(exclude)
+        return list(itertools.islice(self.iter_unique(exclude), min(count, self.size - len(exclude))))
+
+    def iter_unique(self, exclude=()):
+        """
+        Yields every index not in exclude exactly once, in pseudo-random order, using
+        constant memory: each include/omit choice of the optional categories is
+        walked as its own permutation, and every draw picks one of the choices
+        that still has combinations left.
+        """
+        walks = []
+        for radices, offsets in self._subspaces():
+            size = 1
+            for radix in radices:
+                size *= radix
+            walks.append((radices, offsets, self._iter_permutation(size)))
+        while walks:
+            n = random.randrange(len(walks))
+            radices, offsets, walk = walks[n]
+            local = next(walk, None)
+            if local is None:
+                del walks[n]
+                continue
+            digits = []
+            for radix, offset in zip(radices, offsets):
+                local, digit = divmod(local, radix)
+                digits.append(digit + offset)
+            index = self.index_of(digits)
+            if index not in exclude:
+                yield index
+
+    def sample_stratified(self, count):
+        """
+        Draws distinct indices in which every value of every category appears
+        as evenly as the count allows (a Latin hypercube over the digits). Each
+        optional category is absent from half of the rows, and its values are
+        spread evenly over the other half.
+        
+        Near full density the swap repair can run out of attempts; any rows still
+        duplicated are then replaced from sample_unique, trading a little balance
+        for the no-repeat guarantee.
+        """
+        count = min(count, self.size)
+        if count == self.size:
+            # Every combination once is perfectly balanced already
+            return random.sample(range(self.size), count)
+        columns = []
+        for (_, values, optional), radix in zip(self.categories, self.radices):
+            if optional:
+                absent = count // 2 + (random.random() < 0.5 if count % 2 else 0)
+                column = [0] * absent + [1 + n % len(values) for n in range(count - absent)]
+            else:
+                column = [n % radix for n in range(count)]
+            random.shuffle(column)
+            columns.append(column)
+        rows = [list(row) for row in zip(*columns)]
+
+        # Resolve duplicate rows by swapping one digit with another row, which keeps every column balanced
+        counts = {}
+        for row in rows:
+            index = self.index_of(row)
+            counts[index] = counts.get(index, 0) + 1
+        for i, row in enumerate(rows):
+            for _ in range(100):
+                if counts[self.index_of(row)] == 1:
+                    break
+                j = random.randrange(count)
+                c = random.randrange(len(self.radices))
+                if row[c] == rows[j][c]:
+                    continue
+                old_i, old_j = self.index_of(row), self.index_of(rows[j])
+                row[c], rows[j][c] = rows[j][c], row[c]
+                new_i, new_j = self.index_of(row), self.index_of(rows[j])
+                if counts.get(new_i) or counts.get(new_j) or new_i == new_j:
+                    row[c], rows[j][c] = rows[j][c], row[c] # Would create another duplicate; undo
+                    continue
+                counts[old_i] -= 1
+                counts[old_j] -= 1
+                counts[new_i] = counts[new_j] = 1
+        indices = list(dict.fromkeys(self.index_of(row) for row in rows))
+        if len(indices) < count:
+            indices += self.sample_unique(count - len(indices), exclude=indices)
+        return indices
+
+def iter_library_metadata(output_dir):
+    """Yields (path, metadata) for every generated PNG in an output directory."""
+    if not os.path.isdir(output_dir):
+        return
+    for name in sorted(os.listdir(output_dir)):
+        if name.lower().endswith('.png'):
+            path = os.path.join(output_dir, name)
+            yield path, read_metadata_from_image(path)
+
+def select_tag_categories(tags_config):
+    """
+    Picks the required and optional categories that exist in the config and have tags.
+    
+    Returns:
+        tuple: (required categories, optional categories), or None if the config defines no tags
+    """
     tag_categories = list(tags_config.keys())
 
     if not tag_categories:
         print_error("No tag categories defined in config.")
-        return []
+        return None
     
     # Define which categories to include in each combination
     # We want to ensure a good mix of different elements
-    required_categories = ["subject", "action", "setting", "mood", "style"]
-    optional_categories = ["lighting", "camera_angle"]
+    required_categories = REQUIRED_TAG_CATEGORIES
+    optional_categories = OPTIONAL_TAG_CATEGORIES
     
     # Verify that required categories exist in the config
     missing_categories = [cat for cat in required_categories if cat not in tag_categories]
     if missing_categories:
         print_warning(f"Some required tag categories are missing from config: {missing_categories}")
-        # Adjust required categories to only include those that exist
-        required_categories = [cat for cat in required_categories if cat in tag_categories]
-    
-    # Adjust optional categories to only include those that exist
-    optional_categories = [cat for cat in optional_categories if cat in tag_categories]
+    # Only use categories that exist and have tags
+    empty_categories = [cat for cat in required_categories if cat in tag_categories and not tags_config[cat]]
+    for category in empty_categories:
+        print_warning(f"Required category '{category}' is empty or not defined.")
+    required_categories = [cat for cat in required_categories if tags_config.get(cat)]
+    optional_categories = [cat for cat in optional_categories if tags_config.get(cat)]
 
     print_info(f"Using categories: {', '.join(tag_categories)}")
     print_info(f"Required: {', '.join(required_categories)}")
     print_info(f"Optional: {', '.join(optional_categories)}")
+    return required_categories, optional_categories
 
-    for i in range(num_combinations):
-        print_progress_bar(i+1, num_combinations, prefix='Progress:', suffix='Complete', length=40)
-        selected_tags = []
-        
-        # Add one tag from each required category
-        for category in required_categories:
-            if category in tags_config and tags_config[category]:
-                selected_tags.append(f"{category}:{random.choice(tags_config[category])}")
-            else:
-                print_warning(f"Required category '{category}' is empty or not defined.")
-        
-        # Randomly decide whether to include each optional category (50% chance)
-        for category in optional_categories:
-            if category in tags_config and tags_config[category] and random.random() > 0.5:
-                selected_tags.append(f"{category}:{random.choice(tags_config[category])}")
-        
-        if not selected_tags:
-            print_warning(f"Could not select any tags for combination {i+1}. Check tag definitions in config.")
-            continue # Skip if no tags could be selected
+def random_tag_combination(tags_config, required_categories, optional_categories):
+    """Draws one tag from each required category and from each optional category with a 50% chance."""
+    selected_tags = []
+    
+    # Add one tag from each required category
+    for category in required_categories:
+        selected_tags.append(f"{category}:{random.choice(tags_config[category])}")
+    
+    # Randomly decide whether to include each optional category (50% chance)
+    for category in optional_categories:
+        if random.random() > 0.5:
+            selected_tags.append(f"{category}:{random.choice(tags_config[category])}")
+    return ", ".join(selected_tags)
+
+def generate_tag_combinations(tags_config, num_combinations, mode="random", existing_tags=()):
+    """
+    Generates combinations of tags from all categories.
+    
+    Modes:
+        random      - draw each category independently (repeats are possible)
+        unique      - no combination is drawn twice
+        stratified  - no repeats, and every tag of every category appears about equally often
+        fill-gaps   - no repeats, and nothing already in existing_tags (tag strings of earlier images)
+    """
+    print_subheader("Generating Tag Combinations", "🏷️")
+    combinations = []
+    categories = select_tag_categories(tags_config)
+    if categories is None:
+        return []
+    required_categories, optional_categories = categories
 
-        combinations.append(", ".join(selected_tags))
+    if mode == "random":
+        for i in range(num_combinations):
+            print_progress_bar(i+1, num_combinations, prefix='Progress:', suffix='Complete', length=40)
+            tags = random_tag_combination(tags_config, required_categories, optional_categories)
+            if not tags:
+                print_warning(f"Could not select any tags for combination {i+1}. Check tag definitions in config.")
+                continue # Skip if no tags could be selected
+            combinations.append(tags)
+    elif mode in TAG_SAMPLING_MODES:
+        if not required_categories and not optional_categories:
+            print_warning("Could not select any tags. Check tag definitions in config.")
+            return []
+        space = TagSpace(tags_config, required_categories, optional_categories)
+        print_info(f"Tag space: {space.size:,} combinations (sampling: {mode})")
+        if mode == "stratified":
+            indices = space.sample_stratified(num_combinations)
+        else:
+            exclude = set()
+            if mode == "fill-gaps":
+                exclude = {index for index in map(space.encode, existing_tags) if index is not None}
+                print_info(f"Skipping {len(exclude):,} combinations already in the library")
+            indices = space.sample_unique(num_combinations, exclude)
+        if len(indices) < num_combinations:
+            print_warning(f"Only {len(indices)} new combinations are left in the tag space.")
+        combinations = [tags for tags in map(space.decode, indices) if tags]
+    else:
+        print_error(f"Unknown tag sampling mode: {mode} (expected one of {', '.join(TAG_SAMPLING_MODES)})")
+        return []
 
     print_success(f"Generated {len(combinations)} tag combinations! 🎯")
     return combinations
 
+STREAM_STRATIFIED_BLOCK = 1000
+
+def iter_tag_combinations(tags_config, num_combinations, mode="random", existing_tags=()):
+    """
+    Lazy counterpart of generate_tag_combinations for streaming runs: combinations
+    are drawn one at a time, so memory does not grow with num_combinations.
+    
+    unique and fill-gaps walk a pseudo-random permutation of the tag space, so they
+    never repeat and keep no record of what was drawn. stratified balances tags
+    within blocks of STREAM_STRATIFIED_BLOCK combinations; a combination may recur
+    in a later block.
+    """
+    print_subheader("Streaming Tag Combinations", "🏷️")
+    categories = select_tag_categories(tags_config)
+    if categories is None:
+        return
+    required_categories, optional_categories = categories
+    if not required_categories and not optional_categories:
+        print_warning("Could not select any tags. Check tag definitions in config.")
+        return
+
+    if mode == "random":
+        for _ in range(num_combinations):
+            yield random_tag_combination(tags_config, required_categories, optional_categories)
+        return
+    if mode not in TAG_SAMPLING_MODES:
+        print_error(f"Unknown tag sampling mode: {mode} (expected one of {', '.join(TAG_SAMPLING_MODES)})")
+        return
+
+    space = TagSpace(tags_config, required_categories, optional_categories)
+    print_info(f"Tag space: {space.size:,} combinations (sampling: {mode}, streaming)")
+    drawn = 0
+    if mode == "stratified":
+        while drawn < num_combinations:
+            for index in space.sample_stratified(min(STREAM_STRATIFIED_BLOCK, num_combinations - drawn)):
+                drawn += 1
+                yield space.decode(index)
+        return
+
+    exclude = set()
+    if mode == "fill-gaps":
+        exclude = {index for index in map(space.encode, existing_tags) if index is not None}
+        print_info(f"Skipping {len(exclude):,} combinations already in the library")
+    for index in space.iter_unique(exclude):
+        if drawn >= num_combinations:
+            return
+        drawn += 1
+        yield space.decode(index)
+    print_warning(f"Only {drawn} new combinations were left in the tag space.")
+
 # --- LM Studio Interaction ---
-def generate_prompts_lm_studio(tag_combinations, lm_config, model_override=None):
-    """Generates detailed prompts using LM Studio."""
-    print_subheader("Generating Prompts with LM Studio", "🧠")
-    prompts = []
-    prompt_template = lm_config.get('prompt_template')
-    model_name = model_override or lm_config.get('model')
+# Sampling parameters for prompt generation
+LM_SAMPLING_CONFIG = {
+    "temperature": 0.8,           # ↑ more randomness & word variety
+    "top_p": 0.95,                # ↑ allows broader probability mass
+    "top_k": 100,                 # ↑ allows sampling from more potential words
+}
 
-    if not prompt_template:
-        print_error("LM Studio 'prompt_template' not configured.")
-        return []
+PROMPT_REQUEST_TEMPLATE = """You are an expert prompt generator for AI image models.
+
+Generate a detailed image prompt for a stock photo based on these tags: {tags}.
+The prompt should be suitable for an AI image generator like Stable Diffusion.
+Focus on visual details, composition, and lighting.
 
+Generate only the prompt text, no explanations or additional text.
+"""
+
+def load_lm_model(lm_config, model_override=None):
+    """Loads the configured LM Studio model. Returns the model handle or None."""
+    model_name = model_override or lm_config.get('model')
     print_info(f"Loading model: {model_name}")
     
-    # Initialize LM Studio model
     try:
-        # Generate a random seed for LM Studio
-        lm_seed = random.randint(1, 2147483647)
+        # Use the configured seed, or a random one so every run varies
+        lm_seed = lm_config.get('seed') or random.randint(1, 2147483647)
         print_info(f"Using LM Studio seed: {lm_seed}")
         
-        model = lms.llm(model_name, config={
-            "seed": lm_seed,
-            "temperature": 0.8,           # ↑ more randomness & word variety
-    "top_p": 0.95,                # ↑ allows broader probability mass
-    "top_k": 100,                 # ↑ allows sampling from more potential words
-        })
+        model = lms.llm(model_name, config={"seed": lm_seed, **LM_SAMPLING_CONFIG})
         print_success(f"Successfully loaded model: {model_name}")
+        return model
     except Exception as e:
         print_error(f"Error loading LM Studio model: {e}")
-        return []
+        return None
+
+def unload_lm_model(model, model_name):
+    """Unloads the LM Studio model to free up GPU resources."""
+    try:
+        model.unload()
+        print_info(f"Unloaded model: {model_name}")
+    except Exception as e:
+        print_warning(f"Could not unload model: {e}")
+
+def request_prompt(model, tags):
+    """Asks the model for a single image prompt for the given tag string."""
+    prompt = PROMPT_REQUEST_TEMPLATE.format(tags=tags)
     
-    for i, tags in enumerate(tag_combinations):
-        print_step(i+1, len(tag_combinations), f"Processing tags: {tags}", "🔄")
-        
-        try:
-            # Create a prompt for the model
-            prompt = f"""You are an expert prompt generator for AI image models.
+    # Use the model to generate the prompt with the schema
+    result = model.respond(prompt, response_format=PromptSchema)
+    
+    # Get the generated prompt from the parsed result
+    return result.parsed["prompt"]
 
-Generate a detailed image prompt for a stock photo based on these tags: {tags}.
-The prompt should be suitable for an AI image generator like Stable Diffusion.
+def request_prompt_batch(model, tags_batch):
+    """
+    Asks the model for one image prompt per tag string in a single request.
+    
+    Returns:
+        dict: Position in tags_batch -> generated prompt, for every well-formed entry
+    """
+    numbered_tags = "\n".join(f"{n+1}. {tags}" for n, tags in enumerate(tags_batch))
+    prompt = f"""You are an expert prompt generator for AI image models.
+
+Generate one detailed image prompt for a stock photo for each of these numbered tag sets:
+{numbered_tags}
+
+Each prompt should be suitable for an AI image generator like Stable Diffusion.
 Focus on visual details, composition, and lighting.
 
+Return exactly {len(tags_batch)} entries. Set "index" to the number of the tag set and "prompt" to its prompt text.
 Generate only the prompt text, no explanations or additional text.
 """
-            
-            # Use the model to generate the prompt with the schema
-            result = model.respond(prompt, response_format=PromptSchema)
-            
-            # Get the generated prompt from the parsed result
-            generated_prompt = result.parsed["prompt"]
-            prompts.append(generated_prompt)
-            print_info(f"Generated: {generated_prompt[:100]}...") # Print snippet
+    
+    result = model.respond(prompt, response_format=BatchPromptSchema)
+    
+    # Map entries back to their tag sets by index, dropping duplicates and malformed entries
+    prompts = {}
+    for item in result.parsed.get("prompts") or []:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index")
+        text = item.get("prompt")
+        if not isinstance(index, int) or not 1 <= index <= len(tags_batch) or (index - 1) in prompts:
+            continue
+        if not isinstance(text, str) or not text.strip():
+            continue
+        prompts[index - 1] = text.strip()
+    return prompts
+
+def generate_prompt_batch(model, batch, max_retries=2):
+    """
+    Generates prompts for a batch of (index, tags) pairs, retrying only the entries
+    that came back missing or malformed.
+    
+    Returns:
+        dict: Index into tag_combinations -> generated prompt
+    """
+    results = {}
+    pending = list(batch)
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt:
+            print_warning(f"Retrying {len(pending)} missing or malformed prompts...")
+        try:
+            parsed = request_prompt_batch(model, [tags for _, tags in pending])
         except Exception as e:
             print_error(f"Error querying LM Studio: {e}")
-            print_warning("Skipping prompt generation for this tag combination.")
-        
-        time.sleep(0.5) # Add a small delay between requests
+            parsed = {}
+        for position, text in parsed.items():
+            results[pending[position][0]] = text
+        pending = [item for position, item in enumerate(pending) if position not in parsed]
+
+    for i, tags in pending:
+        print_warning(f"Skipping prompt generation for tag combination {i+1}: {tags}")
+    return results
+
+class PromptCache:
+    """
+    On-disk LRU cache of generated prompts, stored in SQLite.
+    
+    Entries are keyed by model, prompt template, tag string, sampling parameters
+    and (optionally) the LM Studio seed. When the cache holds more than
+    max_entries prompts, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS prompts ("
+                         "key TEXT PRIMARY KEY, prompt TEXT NOT NULL, tags TEXT, created REAL, last_used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS prompts_last_used ON prompts (last_used)")
+        self._db.commit()
 
-    # Unload the model to free up GPU resources
+    @staticmethod
+    def make_key(model_name, template, tags, sampling, seed=None):
+        payload = json.dumps([model_name, template, tags, sampling, seed], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT prompt FROM prompts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE prompts SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key, prompt, tags=None):
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO prompts (key, prompt, tags, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                             (key, prompt, tags, now, now))
+            count = self._db.execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute("DELETE FROM prompts WHERE key IN "
+                                 "(SELECT key FROM prompts ORDER BY last_used ASC LIMIT ?)", (count - self.max_entries,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def open_prompt_cache(lm_config):
+    """Opens the prompt cache configured in the lm_studio section, or returns None if it is off."""
+    if lm_config.get('prompt_cache', 'fresh') == 'off':
+        return None
     try:
-        model.unload()
-        print_info(f"Unloaded model: {model_name}")
-    except Exception as e:
-        print_warning(f"Could not unload model: {e}")
+        return PromptCache(lm_config.get('prompt_cache_path', os.path.join("cache", "prompts.sqlite")),
+                           int(lm_config.get('prompt_cache_size', 50000)))
+    except sqlite3.Error as e:
+        print_warning(f"Prompt cache unavailable: {e}")
+        return None
+
+class PromptDeduplicator:
+    """
+    Finds near-duplicate prompts with MinHash over word shingles.
+    
+    A prompt's MinHash signature estimates the Jaccard similarity between its
+    set of word pairs and another prompt's; signatures are bucketed by bands
+    (locality-sensitive hashing), so a lookup only compares against prompts that
+    share a band instead of the whole library. Only the `window` most recently
+    added prompts are kept, so memory stays bounded on very long runs.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, threshold=0.7, retries=1, num_perm=30, bands=10, shingle_size=2, window=20000):
+        rng = random.Random(1) # Fixed permutations, so signatures are comparable across runs
+        self.threshold = threshold
+        self.retries = retries
+        self.shingle_size = shingle_size
+        self._perms = [(rng.randrange(1, self._PRIME), rng.randrange(self._PRIME)) for _ in range(num_perm)]
+        self._rows = num_perm // bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = OrderedDict()
+        self._next_id = 0
+        self.window = window
+        self.reprompted = 0
+        self.dropped = 0
+
+    def signature(self, text):
+        words = re.findall(r"[a-z0-9']+", text.lower())
+        if not words:
+            return None
+        size = min(self.shingle_size, len(words))
+        hashes = [int.from_bytes(hashlib.blake2b(" ".join(words[i:i+size]).encode('utf-8'), digest_size=8).digest(), 'big')
+                  for i in range(len(words) - size + 1)]
+        hashes = set(hashes)
+        return tuple(min((a * h + b) % self._PRIME for h in hashes) for a, b in self._perms)
+
+    def _bands(self, signature):
+        for band in range(len(self._buckets)):
+            yield band, signature[band * self._rows:(band + 1) * self._rows]
+
+    def find(self, text):
+        """Returns (similarity, label) of the most similar known prompt above the threshold, or None."""
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        candidates = set()
+        for band, key in self._bands(signature):
+            candidates.update(self._buckets[band].get(key, ()))
+        best = None
+        for n in candidates:
+            other, label = self._signatures[n]
+            similarity = sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+            if similarity >= self.threshold and (best is None or similarity > best[0]):
+                best = (similarity, label)
+        return best
+
+    def add(self, text, label):
+        signature = self.signature(text)
+        if signature is None:
+            return
+        n = self._next_id
+        self._next_id += 1
+        self._signatures[n] = (signature, label)
+        for band, key in self._bands(signature):
+            self._buckets[band].setdefault(key, set()).add(n)
+        if len(self._signatures) > self.window:
+            oldest, (old_signature, _) = self._signatures.popitem(last=False)
+            for band, key in self._bands(old_signature):
+                bucket = self._buckets[band][key]
+                bucket.discard(oldest)
+                if not bucket:
+                    del self._buckets[band][key]
+
+    def record_duplicate(self, reprompted):
+        if reprompted:
+            self.reprompted += 1
+        else:
+            self.dropped += 1
+
+    def report(self, renders_per_prompt=1):
+        duplicates = self.reprompted + self.dropped
+        if duplicates:
+            print_info(f"Near-duplicate prompts: {duplicates} ({self.reprompted} requested again, {self.dropped} dropped); "
+                       f"{duplicates * renders_per_prompt} duplicate GPU jobs saved")
+
+def make_prompt_deduplicator(lm_config, output_dir=None):
+    """
+    Builds the near-duplicate filter configured by `lm_studio.dedup_threshold`, seeded
+    with the Prompt metadata of the images already in output_dir (unless `dedup_library`
+    is false). Returns None if deduplication is off.
+    """
+    threshold = lm_config.get('dedup_threshold')
+    if threshold is None or threshold is False:
+        return None
+    dedup = PromptDeduplicator(float(threshold), int(lm_config.get('dedup_retries', 1)),
+                               window=int(lm_config.get('dedup_window', 20000)))
+    if output_dir and lm_config.get('dedup_library', True):
+        count = 0
+        for path, metadata in iter_library_metadata(output_dir):
+            if metadata.get('Prompt'):
+                dedup.add(metadata['Prompt'], os.path.basename(path))
+                count += 1
+        print_info(f"Checking new prompts against {min(count, dedup.window)} prompts in the library")
+    return dedup
+
+def iter_prompts_lm_studio(tag_combinations, lm_config, model_override=None, stop_event=None, model_provider=None,
+                           timings=None, dedup=None, total=None):
+    """
+    Generates detailed prompts using LM Studio, yielding each one as soon as it is ready.
+    
+    With `lm_studio.batch_size` above 1, that many tag combinations are sent in
+    each request. With `lm_studio.concurrency` above 1, up to that many requests
+    run in parallel on a bounded thread pool; a new request is only sent once an
+    earlier one has finished, and results are always yielded in tag order.
+    
+    Generated prompts are stored in the prompt cache. With `lm_studio.prompt_cache`
+    set to "reuse", cached prompts are used instead of calling the model, and the
+    model is only loaded if some tag combination is not cached.
+    
+    A model_provider callable may supply an already loaded model (as in daemon
+    mode); such a model is left loaded afterwards. If a timings dict is given,
+    it receives the seconds spent on the request that produced each prompt.
+    
+    With a PromptDeduplicator, prompts too similar to one already accepted (in
+    this run or in the library) are requested again, up to `dedup.retries` times,
+    and dropped if they stay too similar. Re-requested prompts may be yielded
+    after later ones. Cached prompts are not checked, since the library already
+    holds the images rendered from them, but later prompts are compared against
+    them.
+    
+    tag_combinations may be a lazy iterator; it is consumed only as requests are
+    sent. Pass total for progress output when it has no len().
+    
+    Yields:
+        tuple: (index into tag_combinations, tag string, generated prompt)
+    """
+    if not lm_config.get('prompt_template'):
+        print_error("LM Studio 'prompt_template' not configured.")
+        return
+    
+    model_name = model_override or lm_config.get('model')
+    batch_size = max(1, int(lm_config.get('batch_size', 1)))
+    concurrency = max(1, int(lm_config.get('concurrency', 1)))
+    batch_retries = lm_config.get('batch_retries', 2)
+    if total is None:
+        total = len(tag_combinations)
+    if batch_size > 1:
+        print_info(f"Requesting {batch_size} prompts per LM Studio call")
+    if concurrency > 1:
+        print_info(f"Sending up to {concurrency} concurrent LM Studio requests")
 
-    print_success(f"Successfully generated {len(prompts)} prompts! 📝")
+    cache = open_prompt_cache(lm_config)
+    reuse_cached = cache is not None and lm_config.get('prompt_cache') == 'reuse'
+    cache_template = lm_config.get('prompt_template', "") + PROMPT_REQUEST_TEMPLATE
+    cache_key = lambda tags: PromptCache.make_key(model_name, cache_template, tags, LM_SAMPLING_CONFIG,
+                                                  lm_config.get('seed'))
+
+    model = None
+    model_failed = False
+
+    def get_model():
+        # Loaded on the first cache miss, so fully cached runs never touch LM Studio
+        nonlocal model, model_failed
+        if model is None and not model_failed:
+            model = model_provider() if model_provider else load_lm_model(lm_config, model_override)
+            model_failed = model is None
+        return model
+
+    def run_request(unit):
+        # Errors are isolated per request: a failed unit just yields no prompts
+        started = time.time()
+        if batch_size > 1:
+            results = generate_prompt_batch(model, unit, batch_retries)
+        else:
+            i, tags = unit[0]
+            try:
+                results = {i: request_prompt(model, tags)}
+            except Exception as e:
+                print_error(f"Error querying LM Studio: {e}")
+                print_warning("Skipping prompt generation for this tag combination.")
+                results = {}
+        if cache is not None:
+            for i, tags in unit:
+                if i in results:
+                    cache.put(cache_key(tags), results[i], tags)
+        if timings is not None:
+            for i in results:
+                timings[i] = round(time.time() - started, 3)
+        return results
+
+    def iter_units():
+        # Cached prompts become ready-made units; misses are grouped into requests
+        misses = []
+        for i, tags in enumerate(tag_combinations):
+            cached = cache.get(cache_key(tags)) if reuse_cached else None
+            if cached is not None:
+                if misses:
+                    yield misses, False
+                    misses = []
+                yield [(i, tags)], {i: cached}
+                continue
+            misses.append((i, tags))
+            if len(misses) == batch_size:
+                yield misses, False
+                misses = []
+        if misses:
+            yield misses, False
+
+    units = iter_units()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lm-studio")
+    pending = deque()
+    retry_units = deque()
+    attempts = {}
+    served = {'reused': 0, 'generated': 0}
+
+    def fill():
+        while len(pending) < concurrency and not (stop_event is not None and stop_event.is_set()):
+            unit, cached = (retry_units.popleft(), False) if retry_units else next(units, (None, None))
+            if unit is None:
+                return
+            if cached:
+                if timings is not None:
+                    timings.update((i, 0.0) for i in cached)
+                pending.append((unit, cached))
+                continue
+            if get_model() is None:
+                continue # Model failed to load; only cached prompts can be served
+            if len(unit) == 1:
+                print_step(unit[0][0]+1, total, f"Processing tags: {unit[0][1]}", "🔄")
+            else:
+                print_step(unit[-1][0]+1, total, f"Processing {len(unit)} tag combinations", "🔄")
+            pending.append((unit, executor.submit(run_request, unit)))
+
+    try:
+        fill()
+        while pending or retry_units:
+            if not pending:
+                fill()
+                if not pending:
+                    break
+            unit, future = pending.popleft()
+            from_cache = isinstance(future, dict)
+            results = future if from_cache else future.result()
+            # Keep the pool busy while the caller consumes these results
+            fill()
+            for i, tags in unit:
+                if i in results and dedup is not None and from_cache:
+                    dedup.add(results[i], f"prompt {i+1} of this run")
+                elif i in results and dedup is not None:
+                    match = dedup.find(results[i])
+                    if match is not None:
+                        attempts[i] = attempts.get(i, 0) + 1
+                        retry = attempts[i] <= dedup.retries
+                        dedup.record_duplicate(retry)
+                        print_warning(f"Prompt {i+1} is {match[0]:.0%} similar to {match[1]}; "
+                                      f"{'requesting another' if retry else 'dropping it'}")
+                        if retry:
+                            retry_units.append([(i, tags)])
+                        else:
+                            attempts.pop(i, None)
+                        continue
+                    dedup.add(results[i], f"prompt {i+1} of this run")
+                    attempts.pop(i, None)
+                if i in results:
+                    print_info(f"Generated: {results[i][:100]}...") # Print snippet
+                    served['reused' if from_cache else 'generated'] += 1
+                    yield i, tags, results[i]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if model is not None and model_provider is None:
+            unload_lm_model(model, model_name)
+        if cache is not None:
+            if reuse_cached:
+                print_info(f"Prompt cache: {served['reused']} reused, {served['generated']} generated")
+            cache.close()
+
+def generate_prompts_lm_studio(tag_combinations, lm_config, model_override=None, journal=None, model_provider=None,
+                               timings=None, dedup=None):
+    """
+    Generates detailed prompts using LM Studio.
+    
+    Returns:
+        list: One prompt per tag combination, in the same order; None where generation failed
+    """
+    print_subheader("Generating Prompts with LM Studio", "🧠")
+    prompts = [None] * len(tag_combinations)
+    for i, _, prompt in iter_prompts_lm_studio(tag_combinations, lm_config, model_override,
+                                               model_provider=model_provider, timings=timings, dedup=dedup):
+        prompts[i] = prompt
+        if journal is not None:
+            journal.record("prompt", index=i, prompt=prompt)
+    generated = sum(1 for prompt in prompts if prompt is not None)
+    print_success(f"Successfully generated {generated} prompts! 📝")
     return prompts
 
+# --- HTTP Client ---
+# Connection settings for ComfyUI HTTP calls; overridden from the comfy_ui config section
+HTTP_SETTINGS = {
+    "connect_timeout": 5.0,   # seconds to establish a connection
+    "read_timeout": 60.0,     # seconds to wait for a response
+    "retries": 3,             # retries for idempotent calls (and connect failures)
+    "backoff": 0.5,           # exponential backoff factor between retries
+    "pool_size": 16,          # keep-alive connections kept per server
+}
+_HTTP_SESSIONS = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+
+def configure_http_client(comfy_config):
+    """Applies http_* settings from the comfy_ui config section, resetting pooled sessions if they changed."""
+    changed = False
+    for key in HTTP_SETTINGS:
+        if comfy_config.get(f"http_{key}") is not None:
+            value = type(HTTP_SETTINGS[key])(comfy_config[f"http_{key}"])
+            changed = changed or value != HTTP_SETTINGS[key]
+            HTTP_SETTINGS[key] = value
+    if changed:
+        close_http_sessions()
+
+def get_http_session(server_address):
+    """Returns the pooled keep-alive session for a ComfyUI server, creating it on first use."""
+    with _HTTP_SESSIONS_LOCK:
+        session = _HTTP_SESSIONS.get(server_address)
+        if session is None:
+            # Reads are retried on errors and 502/503/504; POSTs only when the connection
+            # could not be established, so a prompt is never queued twice
+            retry = Retry(
+                total=HTTP_SETTINGS["retries"],
+                connect=HTTP_SETTINGS["retries"],
+                read=HTTP_SETTINGS["retries"],
+                status=HTTP_SETTINGS["retries"],
+                backoff_factor=HTTP_SETTINGS["backoff"],
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(["GET", "HEAD"]),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_SETTINGS["pool_size"], max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _HTTP_SESSIONS[server_address] = session
+        return session
+
+def http_timeout():
+    return (HTTP_SETTINGS["connect_timeout"], HTTP_SETTINGS["read_timeout"])
+
+def http_pool_stats():
+    """
+    Counts requests and newly opened connections per server.
+    
+    Returns:
+        dict: server_address -> {'requests', 'connections', 'reused'}
+    """
+    stats = {}
+    with _HTTP_SESSIONS_LOCK:
+        for server_address, session in _HTTP_SESSIONS.items():
+            num_requests = num_connections = 0
+            # The same adapter is mounted for http:// and https://
+            for adapter in {id(a): a for a in session.adapters.values()}.values():
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is not None:
+                        num_requests += pool.num_requests
+                        num_connections += pool.num_connections
+            stats[server_address] = {
+                "requests": num_requests,
+                "connections": num_connections,
+                "reused": max(0, num_requests - num_connections),
+            }
+    return stats
+
+def report_http_pool_stats():
+    """Prints how many requests each server's connection pool served, and over how many connections."""
+    for server_address, stats in http_pool_stats().items():
+        print_info(f"HTTP {server_address}: {stats['requests']} requests over {stats['connections']} connections "
+                   f"({stats['reused']} reused)")
+
+def close_http_sessions():
+    with _HTTP_SESSIONS_LOCK:
+        for session in _HTTP_SESSIONS.values():
+            session.close()
+        _HTTP_SESSIONS.clear()
+
 # --- ComfyUI Interaction (Adapted from example_comfy.py) ---
 def queue_prompt(prompt_workflow, client_id, server_address):
     """Queues a prompt workflow to ComfyUI."""
     p = {"prompt": prompt_workflow, "client_id": client_id}
     data = json.dumps(p).encode('utf-8')
     try:
-        req = requests.post(f"http://{server_address}/prompt", data=data)
+        req = get_http_session(server_address).post(f"http://{server_address}/prompt", data=data, timeout=http_timeout())
         req.raise_for_status()
         return req.json()
     except requests.exceptions.RequestException as e:
@@ -301,9 +1129,8 @@ def queue_prompt(prompt_workflow, client_id, server_address):
 def get_image(filename, subfolder, folder_type, server_address):
     """Gets an image from ComfyUI server."""
     data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urlparse(f"http://{server_address}/view")._replace(query=requests.compat.urlencode(data))
     try:
-        response = requests.get(url_values.geturl())
+        response = get_http_session(server_address).get(f"http://{server_address}/view", params=data, timeout=http_timeout())
         response.raise_for_status()
         return response.content
     except requests.exceptions.RequestException as e:
@@ -313,49 +1140,65 @@ def get_image(filename, subfolder, folder_type, server_address):
 def get_history(prompt_id, server_address):
     """Gets the execution history for a prompt from ComfyUI."""
     try:
-        response = requests.get(f"http://{server_address}/history/{prompt_id}")
+        response = get_http_session(server_address).get(f"http://{server_address}/history/{prompt_id}", timeout=http_timeout())
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print_error(f"Error getting history from ComfyUI: {e}")
         return None
 
-def get_images_from_websocket(ws, server_address, client_id, output_dir, prompt_id):
-    """Listens to ComfyUI websocket for prompt execution status and retrieves images."""
-    print_info(f"Waiting for ComfyUI to generate image...")
-    image_saved = False
-    while True:
-        try:
-            out = ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-                if message['type'] == 'executing':
-                    data = message['data']
-                    if data['node'] is None and data['prompt_id'] == prompt_id:
-                        print_success(f"Generation complete!")
-                        break # Execution is done
-            else:
-                continue # previews are binary data
-        except websocket.WebSocketConnectionClosedException:
-            print_error("WebSocket connection closed unexpectedly.")
-            return False # Indicate failure
-        except Exception as e:
-            print_error(f"Error processing WebSocket message: {e}")
-            # Decide if we should break or continue based on error
-            break # Safer to break on unknown errors
+def get_queue(server_address):
+    """Gets the running and pending queue of a ComfyUI server."""
+    try:
+        response = get_http_session(server_address).get(f"http://{server_address}/queue", timeout=http_timeout())
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print_error(f"Error getting queue from ComfyUI: {e}")
+        return None
+
+def websocket_image_bytes(frame):
+    """Strips the 8-byte header (event type, image format) from a ComfyUI binary image frame."""
+    return bytes(frame[8:])
 
-    # Fetch history and retrieve image after execution finishes
+def use_websocket_save_nodes(workflow):
+    """
+    Swaps SaveImage output nodes for SaveImageWebsocket, so ComfyUI pushes the
+    finished images over the websocket instead of writing them to its output folder.
+    
+    Returns:
+        list: IDs of the nodes that now deliver images over the websocket
+    """
+    node_ids = []
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict):
+            continue
+        if node.get('class_type') == 'SaveImage':
+            node['class_type'] = 'SaveImageWebsocket'
+            node['inputs'] = {"images": node.get('inputs', {}).get('images')}
+            node.setdefault('_meta', {})['title'] = "SaveImageWebsocket"
+        if node.get('class_type') == 'SaveImageWebsocket':
+            node_ids.append(node_id)
+    return node_ids
+
+def download_images_from_history(server_address, prompt_id):
+    """
+    Downloads every image a finished prompt produced.
+    
+    Returns:
+        list: (filename, image bytes) tuples; empty if nothing could be retrieved
+    """
     history = get_history(prompt_id, server_address)
     if not history or prompt_id not in history:
          print_error(f"Could not find history for prompt_id: {prompt_id}")
-         return False
+         return []
 
     history_data = history[prompt_id]
     outputs = history_data.get('outputs', {})
 
     # Look for the SaveImage node in the outputs
     # We'll look for any node that has 'images' in its output
-    image_saved = False
+    images = []
     for node_id, node_output in outputs.items():
         if 'images' in node_output:
             images_output = node_output['images']
@@ -365,194 +1208,2363 @@ def get_images_from_websocket(ws, server_address, client_id, output_dir, prompt_
                     subfolder = image_data.get('subfolder', '')
                     img_type = image_data.get('type', 'output') # Usually 'output' or 'temp'
 
-                    print_info(f"Saving image...")
                     image_content = get_image(filename, subfolder, img_type, server_address)
                     if image_content:
-                        try:
-                            image_filepath = os.path.join(output_dir, filename)
-                            with open(image_filepath, 'wb') as f:
-                                f.write(image_content)
-                            print_success(f"Image saved to: {image_filepath}")
-                            image_saved = True
-                        except IOError as e:
-                            print_error(f"Error saving image {filename}: {e}")
+                        images.append((filename, image_content))
                     else:
                         print_error(f"Failed to retrieve image content for {filename}.")
                 else:
                     print_warning("Image output data found but missing 'filename'.")
 
-    if not image_saved:
+    if not images:
         print_warning("No images found in the workflow output.")
         # Check if the workflow actually ran to completion or failed mid-way
         status_data = history_data.get('status', {})
         if status_data.get('status_str') == 'error':
              print_error(f"ComfyUI workflow execution failed: {status_data.get('exception_message', 'Unknown error')}")
 
-    return image_saved
+    return images
 
-def generate_images_comfyui(prompts, config, tag_combinations=None, workflow_name="flux_dev"):
-    """Generates images for each prompt using ComfyUI."""
-    print_subheader("Generating Images with ComfyUI", "🖼️")
-    server_address = config['comfy_ui'].get('server_address')
-    client_id = config['comfy_ui'].get('client_id')
-    output_dir = config['comfy_ui'].get('output_directory')
-    
-    print_info(f"Saving images to: {output_dir}")
-    
-    # Load workflow from file - handle .wf extension
-    workflow_base_path = os.path.join("workflows", workflow_name)
-    workflow_wf_path = os.path.join("workflows", f"{workflow_name}.wf")
+class ComfyListener:
+    """
+    Reads a ComfyUI websocket on a background thread and routes events by prompt_id.
     
-    # Try with .wf extension first, then without extension for backward compatibility
-    if os.path.exists(workflow_wf_path):
-        workflow_path = workflow_wf_path
-    else:
-        workflow_path = workflow_base_path
-        
-    try:
-        with open(workflow_path, 'r') as f:
-            workflow_str = f.read()
-        print_info(f"Using workflow: {workflow_name}")
-    except FileNotFoundError:
-        print_error(f"Workflow file not found: {workflow_path}")
-        print_info(f"Make sure the workflow file exists in the 'workflows' directory")
-        return
-    except Exception as e:
-        print_error(f"Error loading workflow: {e}")
-        return
+    Each queued prompt registers a completion handler with watch(); the handler is
+    called as handler(prompt_id, success, error_message) once ComfyUI reports the
+    prompt as finished or failed. Handlers run on the listener thread, so they
+    should hand any slow work off to another thread.
     
-    # Validate workflow for required placeholders
-    is_valid, missing_required, missing_recommended = validate_workflow(workflow_str)
-    if not is_valid:
-        print_error(f"Workflow is missing required placeholders: {missing_required}")
-        print_warning(f"Workflow is missing recommended placeholders: {missing_recommended}")
-        return
+    Binary frames that arrive while one of capture_nodes is executing are kept as
+    that prompt's images and can be collected with pop_images().
     
-    # Get parameters from config with defaults if not specified
-    steps = config['comfy_ui'].get('steps', 20)
-    width = config['comfy_ui'].get('width', 1024)
-    height = config['comfy_ui'].get('height', 1024)
+    ComfyUI broadcasts a status message whenever its queue changes; if on_status
+    is set it is called with the number of prompts remaining on the server.
+    """
+
+    def __init__(self, ws, capture_nodes=None):
+        self.ws = ws
+        self.capture_nodes = set(capture_nodes or [])
+        self.on_status = None
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._finished = {}
+        self._started = {}
+        self._images = {}
+        self._current = (None, None)
+        self._closed = False
+        self._dead = False
+        self._thread = threading.Thread(target=self._run, name="comfyui-listener", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def watch(self, prompt_id, handler):
+        """Registers a completion handler for a queued prompt."""
+        with self._lock:
+            if prompt_id in self._finished:
+                result = self._finished.pop(prompt_id)
+            elif self._dead:
+                result = (False, "WebSocket connection closed")
+            else:
+                self._handlers[prompt_id] = handler
+                return
+        handler(prompt_id, *result)
+
+    def is_alive(self):
+        return self._thread.is_alive() and not self._dead
+
+    def pop_images(self, prompt_id):
+        """Returns the image bytes pushed over the websocket for a prompt."""
+        with self._lock:
+            return self._images.pop(prompt_id, [])
+
+    def pop_execution_time(self, prompt_id):
+        """Returns seconds since ComfyUI started executing the prompt, or None if unknown."""
+        with self._lock:
+            started = self._started.pop(prompt_id, None)
+        return time.time() - started if started is not None else None
+
+    def _complete(self, prompt_id, success, error_message=None):
+        with self._lock:
+            handler = self._handlers.pop(prompt_id, None)
+            if handler is None:
+                # Finished before watch() was called; remember the outcome
+                self._finished[prompt_id] = (success, error_message)
+                return
+        handler(prompt_id, success, error_message)
+
+    def _handle_message(self, message):
+        msg_type = message.get('type')
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if msg_type == 'execution_start' and prompt_id:
+            with self._lock:
+                self._started[prompt_id] = time.time()
+        elif msg_type == 'executing' and prompt_id:
+            self._current = (prompt_id, data.get('node'))
+            if data.get('node') is None:
+                self._complete(prompt_id, True)
+        elif msg_type == 'execution_error' and prompt_id:
+            self._complete(prompt_id, False, data.get('exception_message', 'Unknown error'))
+        elif msg_type == 'execution_interrupted' and prompt_id:
+            self._complete(prompt_id, False, "Execution interrupted")
+        elif msg_type == 'status':
+            queue_remaining = ((data.get('status') or {}).get('exec_info') or {}).get('queue_remaining')
+            if queue_remaining is not None and self.on_status is not None:
+                self.on_status(int(queue_remaining))
+
+    def _run(self):
+        while True:
+            try:
+                out = self.ws.recv()
+                if isinstance(out, str):
+                    self._handle_message(json.loads(out))
+                else:
+                    prompt_id, node_id = self._current
+                    if prompt_id and node_id in self.capture_nodes:
+                        with self._lock:
+                            self._images.setdefault(prompt_id, []).append(websocket_image_bytes(out))
+                    # Other binary frames are previews; nothing to route
+            except Exception as e:
+                if not self._closed:
+                    print_error(f"ComfyUI WebSocket listener stopped: {e}")
+                break
+        with self._lock:
+            self._dead = True
+            pending = list(self._handlers.items())
+            self._handlers.clear()
+        for prompt_id, handler in pending:
+            handler(prompt_id, False, "WebSocket connection closed")
+
+    def close(self):
+        self._closed = True
+        try:
+            # Unblock the reader thread before tearing the socket down
+            self.ws.send_close()
+            self.ws.abort()
+        except Exception:
+            pass
+        self._thread.join(timeout=5)
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+def get_comfy_servers(comfy_config):
+    """
+    Returns the ComfyUI servers to render on.
+    
+    `server_address` may be a single "host:port" string, or `servers` may list
+    several entries, each either a "host:port" string or a dict with `address`
+    and optional `client_id` / `max_in_flight` / `target_queue_depth`.
+    
+    Returns:
+        list: Dicts with 'address', 'client_id', 'max_in_flight' and 'target_queue_depth'
+    """
+    entries = comfy_config.get('servers') or comfy_config.get('server_address') or []
+    if isinstance(entries, (str, dict)):
+        entries = [entries]
+    default_in_flight = max(1, int(comfy_config.get('max_in_flight', 1)))
+    default_depth = comfy_config.get('target_queue_depth')
+
+    servers = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {"address": entry}
+        address = entry.get('address') or entry.get('server_address')
+        if not address:
+            print_warning(f"Skipping ComfyUI server entry without an address: {entry}")
+            continue
+        # The first server keeps the configured client_id; every other node needs its own
+        client_id = entry.get('client_id') or (comfy_config.get('client_id') if i == 0 else None) or str(uuid.uuid4())
+        target_depth = entry.get('target_queue_depth', default_depth)
+        target_depth = max(1, int(target_depth)) if target_depth is not None else None
+        servers.append({
+            "address": address,
+            "client_id": client_id,
+            "max_in_flight": max(1, int(entry.get('max_in_flight', default_in_flight))),
+            "target_queue_depth": target_depth,
+        })
+    return servers
+
+class ComfyNode:
+    """One ComfyUI server with its own websocket, client_id and load statistics."""
+
+    def __init__(self, address, client_id, max_in_flight=1, target_queue_depth=None, history_size=20,
+                 capture_nodes=None):
+        self.address = address
+        self.capture_nodes = capture_nodes
+        self.client_id = client_id
+        self.max_in_flight = max_in_flight
+        self.target_queue_depth = target_queue_depth
+        self.in_flight = 0
+        self.jobs_completed = 0
+        self.remote_depth = 0
+        self.queue_polled_at = 0.0
+        self.status_updates = False
+        self.job_times = deque(maxlen=history_size)
+        self.loaded_models = None
+        self.listener = None
+
+    def connect(self):
+        ws = connect_comfyui_websocket(self.address, self.client_id)
+        if ws is None:
+            return False
+        self.listener = ComfyListener(ws, self.capture_nodes).start()
+        return True
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+
+    def has_free_slot(self):
+        return self.in_flight < self.max_in_flight
+
+    def has_capacity(self):
+        """True if a job may be sent now: a slot is free and the server's queue is below its target depth."""
+        if not self.has_free_slot():
+            return False
+        # The remote queue includes other clients' prompts, so a busy shared server holds us back
+        return self.target_queue_depth is None or self.remote_depth < self.target_queue_depth
+
+    def refresh_queue_depth(self, max_age=1.0):
+        """Re-reads the server's /queue depth if the cached value is older than max_age seconds."""
+        if time.time() - self.queue_polled_at < max_age:
+            return
+        queue_data = get_queue(self.address)
+        self.queue_polled_at = time.time()
+        if queue_data is not None:
+            self.remote_depth = len(queue_data.get('queue_running', [])) + len(queue_data.get('queue_pending', []))
+
+    def average_job_time(self):
+        return sum(self.job_times) / len(self.job_times) if self.job_times else None
+
+    def estimated_wait(self, default_job_time):
+        """Seconds until a newly queued job would finish on this node."""
+        job_time = self.average_job_time() or default_job_time
+        # The remote queue also counts our own jobs, but may be stale between polls
+        depth = max(self.remote_depth, self.in_flight)
+        return (depth + 1) * job_time
+
+class ComfyScheduler:
+    """
+    Sends each job to the ComfyUI node expected to finish it soonest.
+    
+    Jobs are only admitted while a node has a free slot and its queue is below
+    its target depth. The depth follows the websocket status messages, with a
+    /queue poll every queue_poll_interval seconds while a node is held back.
+    """
+
+    def __init__(self, nodes, queue_poll_interval=1.0):
+        self.nodes = nodes
+        self.queue_poll_interval = queue_poll_interval
+        self._cond = threading.Condition()
+        for node in nodes:
+            if node.listener is not None:
+                node.listener.on_status = lambda depth, node=node: self._on_status(node, depth)
+
+    def _on_status(self, node, queue_remaining):
+        with self._cond:
+            node.remote_depth = queue_remaining
+            node.queue_polled_at = time.time()
+            node.status_updates = True
+            self._cond.notify_all()
+
+    def _default_job_time(self):
+        times = [t for node in self.nodes for t in node.job_times]
+        return sum(times) / len(times) if times else 1.0
+
+    def acquire(self):
+        """Blocks until some node can take a job and reserves a slot on the least-loaded one."""
+        while True:
+            with self._cond:
+                candidates = [node for node in self.nodes if node.has_capacity()]
+                if not candidates:
+                    # Woken by release() or a status message; the timeout falls back to polling /queue
+                    self._cond.wait(self.queue_poll_interval)
+                    candidates = [node for node in self.nodes if node.has_capacity()]
+                    held_back = [node for node in self.nodes if node.has_free_slot() and not node.has_capacity()]
+            if candidates:
+                break
+            for node in held_back:
+                node.refresh_queue_depth(self.queue_poll_interval)
+
+        if len(candidates) > 1:
+            for node in candidates:
+                node.refresh_queue_depth(self.queue_poll_interval)
+
+        with self._cond:
+            default_job_time = self._default_job_time()
+            # Ties go to the node with the fewest jobs so unmeasured nodes get sampled
+            node = min(candidates, key=lambda n: (n.estimated_wait(default_job_time), n.in_flight, n.jobs_completed))
+            node.in_flight += 1
+            node.remote_depth += 1
+            return node
+
+    def release(self, node, job_time=None):
+        """Frees a node's slot once its job has finished, recording how long it took."""
+        with self._cond:
+            node.in_flight -= 1
+            if not node.status_updates:
+                # Without status messages, estimate the depth until the next /queue poll
+                node.remote_depth = max(0, node.remote_depth - 1)
+            if job_time is not None:
+                node.job_times.append(job_time)
+                node.jobs_completed += 1
+            self._cond.notify_all()
+
+    def wait_idle(self):
+        with self._cond:
+            while any(node.in_flight for node in self.nodes):
+                self._cond.wait()
+
+# Default values for workflow placeholders
+DEFAULT_NEGATIVE_PROMPT = "text, watermark, signature, blurry, distorted, low resolution, poorly drawn, bad anatomy, deformed, disfigured, out of frame, cropped"
+
+# --- Workflow Compilation ---
+WORKFLOW_CACHE_DIR = os.path.join("workflows", ".cache")
+WORKFLOW_COMPILER_VERSION = 1
+PLACEHOLDER_PATTERN = re.compile(r'\{([A-Z][A-Z0-9_]*)\}')
+# Matches either a complete JSON string literal or a bare (unquoted) placeholder
+_JSON_STRING_OR_PLACEHOLDER = re.compile(r'"(?:[^"\\]|\\.)*"|\{[A-Z][A-Z0-9_]*\}')
+_BARE_PLACEHOLDER_PATTERN = re.compile('^\x00bare:([A-Z][A-Z0-9_]*)\x00$')
+_COMPILED_WORKFLOWS = {}
+
+def resolve_workflow_path(workflow_name):
+    """Returns the path of a workflow file, with or without the .wf extension, or None."""
+    workflow_wf_path = os.path.join("workflows", f"{workflow_name}.wf")
+    workflow_base_path = os.path.join("workflows", workflow_name)
+    
+    # Try with .wf extension first, then without extension for backward compatibility
+    if os.path.exists(workflow_wf_path):
+        return workflow_wf_path
+    if os.path.exists(workflow_base_path):
+        return workflow_base_path
+    return None
+
+def load_workflow(workflow_name):
+    """Loads a workflow template from the workflows directory. Returns the raw string or None."""
+    workflow_path = resolve_workflow_path(workflow_name) or os.path.join("workflows", workflow_name)
+    try:
+        with open(workflow_path, 'r') as f:
+            workflow_str = f.read()
+        print_info(f"Using workflow: {workflow_name}")
+        return workflow_str
+    except FileNotFoundError:
+        print_error(f"Workflow file not found: {workflow_path}")
+        print_info(f"Make sure the workflow file exists in the 'workflows' directory")
+        return None
+    except Exception as e:
+        print_error(f"Error loading workflow: {e}")
+        return None
+
+def _collect_workflow_slots(node, path, slots):
+    """Records the JSON path of every placeholder found in the workflow's string values."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            _collect_workflow_slots(value, path + [key], slots)
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            _collect_workflow_slots(value, path + [index], slots)
+    elif isinstance(node, str):
+        bare = _BARE_PLACEHOLDER_PATTERN.match(node)
+        if bare:
+            # Unquoted in the .wf file: the value is inserted as-is (e.g. a number)
+            slots.append({"path": path, "placeholder": bare.group(1), "mode": "raw"})
+        elif PLACEHOLDER_PATTERN.fullmatch(node):
+            slots.append({"path": path, "placeholder": node[1:-1], "mode": "string"})
+        else:
+            names = PLACEHOLDER_PATTERN.findall(node)
+            if names:
+                # Placeholder embedded in longer text, e.g. "photo of {PROMPT}"
+                slots.append({"path": path, "placeholders": names, "mode": "template", "template": node})
+
+def compile_workflow(workflow_str):
+    """
+    Parses a workflow template once into a JSON structure plus placeholder slots.
+    
+    Placeholders may be quoted ("{PROMPT}"), embedded in longer strings, or bare
+    ({SEED}). Compiled templates are cached in memory and in workflows/.cache,
+    keyed by the SHA-256 of the template text.
+    
+    Returns:
+        dict: 'workflow' (parsed JSON), 'slots' (placeholder locations) and 'placeholders' (names used)
+        
+    Raises:
+        ValueError: If the template is not valid JSON once placeholders are quoted
+    """
+    digest = hashlib.sha256(workflow_str.encode('utf-8')).hexdigest()
+    if digest in _COMPILED_WORKFLOWS:
+        return _COMPILED_WORKFLOWS[digest]
+
+    cache_path = os.path.join(WORKFLOW_CACHE_DIR, f"{digest}.json")
+    compiled = None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('version') == WORKFLOW_COMPILER_VERSION and cached.get('sha256') == digest:
+            compiled = cached
+    except (OSError, ValueError):
+        pass
+
+    if compiled is None:
+        quoted = _JSON_STRING_OR_PLACEHOLDER.sub(
+            lambda m: m.group(0) if m.group(0).startswith('"') else json.dumps(f"\x00bare:{m.group(0)[1:-1]}\x00"),
+            workflow_str)
+        try:
+            workflow = json.loads(quoted)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Error parsing workflow JSON: {e}")
+        slots = []
+        _collect_workflow_slots(workflow, [], slots)
+        placeholders = set()
+        for slot in slots:
+            placeholders.update(slot.get('placeholders') or [slot.get('placeholder')])
+        compiled = {
+            "version": WORKFLOW_COMPILER_VERSION,
+            "sha256": digest,
+            "workflow": workflow,
+            "slots": slots,
+            "placeholders": sorted(placeholders),
+        }
+        try:
+            os.makedirs(WORKFLOW_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(compiled, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print_warning(f"Could not cache compiled workflow: {e}")
+
+    _COMPILED_WORKFLOWS[digest] = compiled
+    return compiled
+
+def load_compiled_workflow(workflow_name):
+    """Loads and compiles a workflow from the workflows directory. Returns the compiled template or None."""
+    workflow_str = load_workflow(workflow_name)
+    if workflow_str is None:
+        return None
+    try:
+        return compile_workflow(workflow_str)
+    except ValueError as e:
+        print_error(str(e))
+        return None
+
+def instantiate_workflow(compiled, values):
+    """
+    Fills a compiled workflow's placeholder slots with values.
+    
+    Only the containers along slot paths are copied; the rest of the structure is
+    shared with the template, so the result must not be mutated elsewhere.
+    
+    Args:
+        compiled (dict): Result of compile_workflow
+        values (dict): Placeholder name (without braces) -> value
+        
+    Returns:
+        dict: The workflow ready to queue on ComfyUI
+    """
+    workflow = dict(compiled['workflow'])
+    copied = set()
+    for slot in compiled['slots']:
+        container = workflow
+        prefix = ()
+        for key in slot['path'][:-1]:
+            prefix += (key,)
+            child = container[key]
+            if prefix not in copied:
+                child = copy.copy(child)
+                container[key] = child
+                copied.add(prefix)
+            container = child
+
+        key = slot['path'][-1]
+        mode = slot['mode']
+        if mode == 'template':
+            text = slot['template']
+            for name in slot['placeholders']:
+                if name in values:
+                    text = text.replace(f"{{{name}}}", str(values[name]))
+            container[key] = text
+        elif slot['placeholder'] in values:
+            value = values[slot['placeholder']]
+            container[key] = value if mode == 'raw' else str(value)
+        elif mode == 'raw':
+            raise ValueError(f"No value for placeholder {{{slot['placeholder']}}}")
+        else:
+            container[key] = f"{{{slot['placeholder']}}}"
+    return workflow
+
+def websocket_delivery_template(compiled):
+    """
+    Returns a copy of a compiled workflow whose SaveImage nodes deliver over the websocket.
+    
+    Returns:
+        tuple: (compiled template, list of websocket-save node IDs)
+    """
+    workflow = copy.deepcopy(compiled['workflow'])
+    node_ids = use_websocket_save_nodes(workflow)
+
+    def has_path(path):
+        node = workflow
+        for key in path:
+            try:
+                node = node[key]
+            except (KeyError, IndexError, TypeError):
+                return False
+        return True
+
+    # SaveImageWebsocket has no filename_prefix input, so its slot disappears
+    slots = [slot for slot in compiled['slots'] if has_path(slot['path'])]
+    return dict(compiled, workflow=workflow, slots=slots), node_ids
+
+def workflow_models(compiled):
+    """
+    Returns the model files a compiled workflow loads (checkpoints, UNets, CLIP, VAE, LoRAs).
+    
+    Workflows with the same result load the same weights, so ComfyUI can render
+    them one after another without swapping models.
+    
+    Returns:
+        tuple: Sorted model file names
+    """
+    models = set()
+    for node in compiled['workflow'].values():
+        if not isinstance(node, dict) or 'Loader' not in node.get('class_type', ''):
+            continue
+        for key, value in (node.get('inputs') or {}).items():
+            if re.search(r'_name\d*$', key) and isinstance(value, str) and '\x00' not in value:
+                models.add(value)
+    return tuple(sorted(models))
+
+class CheckpointOrderer:
+    """
+    Reorders a job stream so consecutive jobs on a ComfyUI node load the same models.
+    
+    Up to `window` jobs are buffered; next() prefers the oldest buffered job whose
+    workflow uses the models the node already has loaded. A job passed over for
+    `window` picks is taken next regardless, so no workflow starves.
+    
+    A lazy job stream (anything but a list or tuple) is read on a feeder thread,
+    and next() only orders the jobs that have already arrived: it waits for one
+    job when none is buffered, never for a full window.
+    """
+
+    def __init__(self, jobs, models_by_workflow, window=32, stop_event=None):
+        self.stop_event = stop_event
+        self.models_by_workflow = models_by_workflow
+        self.window = max(1, window)
+        self._buffer = deque()
+        self._picks = 0
+        self._last_arrival = None
+        self.swaps = 0
+        self.arrival_swaps = 0
+        self._exhausted = False
+        self._closed = threading.Event()
+        self._error = None
+        if isinstance(jobs, (list, tuple)) or self.window == 1:
+            self._jobs = iter(jobs)
+            self._arrivals = None
+        else:
+            self._jobs = None
+            self._arrivals = queue.Queue(maxsize=self.window)
+            threading.Thread(target=self._feed, args=(jobs,), name="checkpoint-orderer", daemon=True).start()
+
+    def _feed(self, jobs):
+        try:
+            for job in jobs:
+                if not self._put(job):
+                    return
+        except Exception as e:
+            self._error = e
+        self._put(_PIPELINE_DONE)
+
+    def _put(self, item):
+        # Give up once the renderer has stopped asking for jobs
+        while not self._closed.is_set():
+            try:
+                self._arrivals.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _take(self, block):
+        """Returns the next arrived job, or None if none is waiting (block=False) or the stream ended."""
+        while not self._exhausted:
+            try:
+                job = self._arrivals.get(timeout=0.5) if block else self._arrivals.get_nowait()
+            except queue.Empty:
+                if not block or (self.stop_event is not None and self.stop_event.is_set()):
+                    return None
+                continue
+            if job is _PIPELINE_DONE:
+                self._exhausted = True
+                if self._error is not None:
+                    raise self._error
+                return None
+            return job
+        return None
+
+    def _add(self, job):
+        models = self.models_for(job)
+        if self._last_arrival is not None and models != self._last_arrival:
+            self.arrival_swaps += 1
+        self._last_arrival = models
+        self._buffer.append((self._picks, job))
+
+    def models_for(self, job):
+        return self.models_by_workflow.get(job['workflow'])
+
+    def _fill(self):
+        if self._arrivals is None:
+            while len(self._buffer) < self.window:
+                job = next(self._jobs, None)
+                if job is None:
+                    return
+                self._add(job)
+            return
+        while len(self._buffer) < self.window:
+            job = self._take(block=not self._buffer)
+            if job is None:
+                return
+            self._add(job)
+
+    def next(self, loaded_models=None):
+        """Returns the next job for a node with loaded_models loaded, or None when the stream is exhausted."""
+        if self.stop_event is not None and self.stop_event.is_set():
+            self._closed.set()
+            return None
+        self._fill()
+        if not self._buffer:
+            self._closed.set()
+            return None
+        pick = 0
+        if loaded_models is not None and self._picks - self._buffer[0][0] < self.window:
+            for i, (_, job) in enumerate(self._buffer):
+                if self.models_for(job) == loaded_models:
+                    pick = i
+                    break
+        _, job = self._buffer[pick]
+        del self._buffer[pick]
+        self._picks += 1
+        if loaded_models is not None and self.models_for(job) != loaded_models:
+            self.swaps += 1
+        return job
+
+    def report(self):
+        if self.arrival_swaps or self.swaps:
+            avoided = max(0, self.arrival_swaps - self.swaps)
+            print_info(f"Model swaps: {self.swaps} ({avoided} avoided by checkpoint-aware ordering)")
+
+def build_workflow(workflow, prompt_text, seed, steps, width, height, filename_prefix,
+                   negative_prompt=DEFAULT_NEGATIVE_PROMPT, batch_size=1):
+    """
+    Fills the placeholders of a workflow template and returns the JSON object.
+    
+    Args:
+        workflow (str or dict): Raw template text or a compiled template
+    """
+    compiled = compile_workflow(workflow) if isinstance(workflow, str) else workflow
+    return instantiate_workflow(compiled, {
+        "PROMPT": prompt_text,
+        "NEGATIVE_PROMPT": negative_prompt,
+        "SEED": seed,
+        "STEPS": steps,
+        "WIDTH": width,
+        "HEIGHT": height,
+        "FILENAME_PREFIX": filename_prefix,
+        "BATCH_SIZE": batch_size,
+    })
+
+def connect_comfyui_websocket(server_address, client_id):
+    """Opens the ComfyUI websocket for the given client. Returns the socket or None."""
+    print_info(f"Connecting to ComfyUI WebSocket at ws://{server_address}/ws?clientId={client_id}")
+    try:
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://{server_address}/ws?clientId={client_id}")
+        print_success("Connected to ComfyUI WebSocket!")
+        return ws
+    except Exception as e:
+        print_error(f"Error connecting to ComfyUI WebSocket: {e}")
+        return None
+
+def make_job_filename(job, workflow_name):
+    """Builds the ComfyUI filename prefix for a job from its tags and the workflow name."""
+    # Create a custom filename based on tags if available
+    custom_filename = f"image_{job['index']+1}"
+    if job.get('tags'):
+        custom_filename = tags_to_filename(job['tags'])
+        # Truncate the displayed filename if it's too long
+        display_filename = custom_filename
+        if len(display_filename) > 40:
+            display_filename = display_filename[:20] + "..." + display_filename[-17:]
+        print_info(f"Using filename based on tags: {display_filename}")
+    
+    # Add workflow name as prefix to the filename
+    custom_filename = f"{workflow_name}_{custom_filename}"
+    print_info(f"Final filename with workflow prefix: {custom_filename}")
+    return custom_filename
+
+def submit_job(config, template, workflow_name, job, server_address=None, client_id=None):
+    """
+    Builds the workflow for a job and queues it on ComfyUI.
+    
+    Returns:
+        dict: The submitted job state (prompt_id, seed, filename prefix, parameters), or None on failure
+    """
+    server_address = server_address or config['comfy_ui'].get('server_address')
+    client_id = client_id or config['comfy_ui'].get('client_id')
+    # Replayed jobs carry the parameters of the image they reproduce
+    steps = job.get('steps') or config['comfy_ui'].get('steps', 20)
+    width = job.get('width') or config['comfy_ui'].get('width', 1024)
+    height = job.get('height') or config['comfy_ui'].get('height', 1024)
+    # Every variation of a prompt comes out of one sampler batch
+    batch_size = job.get('batch_size') or max(1, int(config['comfy_ui'].get('variations', 1)))
+    prompt_text = job['prompt']
+
+    # Print the full prompt
+    print_info(f"Prompt: {prompt_text}")
+
+    # Generate a random seed for this prompt
+    random_seed = job.get('seed') or random.randint(1, MAX_SEED)
+    custom_filename = make_job_filename(job, workflow_name)
+
+    try:
+        current_workflow = build_workflow(template, prompt_text, random_seed, steps, width, height, custom_filename,
+                                          batch_size=batch_size)
+    except ValueError as e:
+        print_error(f"Error building workflow: {e}")
+        print_warning("Skipping this prompt.")
+        return None
+
+    batch_str = f", batch: {batch_size}" if batch_size > 1 else ""
+    print_info(f"Using seed: {random_seed}, steps: {steps}, dimensions: {width}x{height}{batch_str}")
+    print_info(f"Negative prompt: {DEFAULT_NEGATIVE_PROMPT[:50]}...")
+
+    # Queue the modified workflow
+    journal = job.get('journal')
+    queued_data = queue_prompt(current_workflow, client_id, server_address)
+    if not queued_data or 'prompt_id' not in queued_data:
+        print_error("Failed to queue prompt in ComfyUI.")
+        if journal is not None:
+            journal.record("failed", index=job['index'], workflow=workflow_name, stage="queue")
+        return None
+
+    print_info(f"Starting generation...")
+    if journal is not None:
+        journal.record("queued", index=job['index'], prompt_id=queued_data['prompt_id'], server=server_address,
+                       seed=random_seed, filename_prefix=custom_filename, workflow=workflow_name,
+                       steps=steps, width=width, height=height, batch_size=batch_size)
+    return {
+        "job": job,
+        "prompt_id": queued_data['prompt_id'],
+        "server_address": server_address,
+        "submitted_at": time.time(),
+        "seed": random_seed,
+        "filename_prefix": custom_filename,
+        "steps": steps,
+        "width": width,
+        "height": height,
+        "batch_size": batch_size,
+        "workflow": workflow_name,
+    }
+
+MAX_SEED = 2147483647
+
+def resolved_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+def complete_job(config, submitted, pushed_images=None):
+    """
+    Saves a finished job's images with the generation metadata.
+    
+    Images pushed over the websocket (pushed_images) are written directly under
+    names derived from the job's filename prefix; otherwise they are looked up in
+    the prompt's history and downloaded from ComfyUI. Every image of a batch is
+    kept, each tagged with its BatchIndex, unless the job asks for a single
+    'batch_index' (a replayed batch image). The files are handed to the output
+    directory's ImageWriter, so this returns before they reach the disk.
+    
+    Returns:
+        Future: Resolves to the number of images saved (0 on failure) once the job is journaled
+    """
+    server_address = submitted['server_address']
+    output_dir = config['comfy_ui'].get('output_directory')
+    prompt_id = submitted['prompt_id']
+    finished_at = time.time()
+    save_timings = {"download": 0.0, "metadata": 0.0, "write": 0.0}
+
+    if config['comfy_ui'].get('image_delivery') == 'websocket':
+        images = [(f"{submitted['filename_prefix']}_{n+1:05d}_.png", image_bytes)
+                  for n, image_bytes in enumerate(pushed_images or [])]
+        if not images:
+            print_warning("No images received over the websocket.")
+    else:
+        images = download_images_from_history(server_address, prompt_id)
+        save_timings['download'] = time.time() - finished_at
+    # Images arrive in batch order, one run of them per save node
+    batch_size = submitted.get('batch_size', 1)
+    images = [(filename, image_content, n % batch_size) for n, (filename, image_content) in enumerate(images)]
+    if submitted['job'].get('batch_index') is not None:
+        images = [image for image in images if image[2] == submitted['job']['batch_index']]
+    journal = submitted['job'].get('journal')
+    if not images:
+        print_error(f"Failed to get image for prompt_id {prompt_id}.")
+        if journal is not None:
+            journal.record("failed", index=submitted['job']['index'], workflow=submitted['workflow'], stage="download",
+                           prompt_id=prompt_id)
+        return resolved_future(0)
+
+    width, height = submitted['width'], submitted['height']
+    metadata = {
+        "Prompt": submitted['job']['prompt'],
+        "Tags": submitted['job'].get('tags') or "",
+        "Seed": submitted['seed'],
+        "Steps": submitted['steps'],
+        "Width": width,
+        "Height": height,
+        "Workflow": submitted['workflow'],
+        "Ratio": round(width/height, 2),
+        "Generator": "Stock Image Generator",
+        "Created": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    if submitted['job'].get('source'):
+        metadata['Source'] = submitted['job']['source']
+    if batch_size > 1:
+        # ComfyUI draws a batch's noise from the one seed; the index picks the image out of it
+        metadata['BatchSize'] = batch_size
+
+    written = get_image_writer(config['comfy_ui']).submit(
+        [(os.path.join(output_dir, filename), image_content, {"BatchIndex": batch_index} if batch_size > 1 else {})
+         for filename, image_content, batch_index in images], metadata)
+    done = Future()
+
+    def finalize(future):
+        saved_files = []
+        try:
+            result = future.result()
+            saved_files = result['files']
+            save_timings.update(result['timings'])
+            for file_path in saved_files:
+                if file_path not in result['duplicates']:
+                    print_success(f"Image saved to: {file_path}")
+            on_image = submitted['job'].get('on_image')
+            if on_image is not None and saved_files:
+                # ComfyUI reports when execution started; the rest of its time was spent queued
+                execution_time = submitted.get('execution_time')
+                in_comfyui = finished_at - submitted['submitted_at']
+                timings = {
+                    **submitted['job'].get('timings', {}),
+                    "queue": round(max(0.0, in_comfyui - execution_time), 3) if execution_time is not None else None,
+                    "render": round(execution_time if execution_time is not None else in_comfyui, 3),
+                    "save": round(time.time() - finished_at, 3),
+                    **{stage: round(seconds, 3) for stage, seconds in save_timings.items()},
+                    "total": round(time.time() - submitted['job'].get('created', submitted['submitted_at'])
+                                   + (submitted['job'].get('timings', {}).get('prompt') or 0.0), 3),
+                }
+                for file_path in saved_files:
+                    on_image({
+                        "path": file_path,
+                        "index": submitted['job']['index'],
+                        "workflow": submitted['workflow'],
+                        "prompt_id": prompt_id,
+                        "metadata": {**metadata, **result['metadata'].get(file_path, {})},
+                        "timings": timings,
+                    })
+        except Exception as e:
+            print_error(f"Error saving images for prompt_id {prompt_id}: {e}")
+        finally:
+            if saved_files:
+                # Thumbnails are best effort; they never affect the image records
+                submit_thumbnails(config['comfy_ui'], [file_path for file_path in saved_files
+                                                       if file_path not in result['duplicates']])
+            if journal is not None:
+                if saved_files:
+                    journal.record("done", index=submitted['job']['index'], workflow=submitted['workflow'],
+                                   prompt_id=prompt_id, files=saved_files)
+                else:
+                    journal.record("failed", index=submitted['job']['index'], workflow=submitted['workflow'],
+                                   stage="save", prompt_id=prompt_id)
+            done.set_result(len(saved_files))
+
+    written.add_done_callback(finalize)
+    return done
+
+def _render_scheduled(nodes, orderer, total, config, templates):
+    """
+    Renders jobs on one or more ComfyUI nodes, keeping several prompts in flight.
+    
+    Each node's ComfyListener demultiplexes websocket events by prompt_id, the
+    ComfyScheduler picks the least-loaded node, the CheckpointOrderer hands it a job
+    using the models it already has loaded, and finished jobs are downloaded on
+    worker threads and written by the ImageWriter while the GPUs move on to the
+    next prompt.
+    
+    Returns:
+        tuple: (images saved, renders that saved at least one image)
+    """
+    scheduler = ComfyScheduler(nodes, config['comfy_ui'].get('queue_poll_interval', 1.0))
+    for node in nodes:
+        depth_str = f", queue depth target {node.target_queue_depth}" if node.target_queue_depth else ""
+        print_info(f"ComfyUI node {node.address}: up to {node.max_in_flight} prompts in flight{depth_str}")
+    counter_lock = threading.Lock()
+    images_generated = 0
+    renders_done = 0
+    pending_saves = set()
+
+    def count_saved(saved):
+        nonlocal images_generated, renders_done
+        with counter_lock:
+            pending_saves.discard(saved)
+        num_saved = saved.result()
+        if num_saved:
+            with counter_lock:
+                images_generated += num_saved
+                renders_done += 1
+                count = images_generated
+            if num_saved == 1:
+                print_success(f"Successfully generated image {count}! 🎉")
+            else:
+                print_success(f"Successfully generated images {count - num_saved + 1}-{count}! 🎉")
+
+    def finish(node, submitted, success, error_message):
+        job_time = None
+        try:
+            job_time = submitted['execution_time'] = node.listener.pop_execution_time(submitted['prompt_id'])
+            if job_time is None:
+                job_time = time.time() - submitted['submitted_at']
+            if not success:
+                print_error(f"ComfyUI failed prompt_id {submitted['prompt_id']} on {node.address}: {error_message}")
+                job_time = None
+                journal = submitted['job'].get('journal')
+                if journal is not None:
+                    journal.record("failed", index=submitted['job']['index'], workflow=submitted['workflow'],
+                                   stage="execute", prompt_id=submitted['prompt_id'], error=error_message)
+            else:
+                saved = complete_job(config, submitted, node.listener.pop_images(submitted['prompt_id']))
+                with counter_lock:
+                    pending_saves.add(saved)
+                saved.add_done_callback(count_saved)
+        except Exception as e:
+            print_error(f"Error finishing prompt_id {submitted['prompt_id']}: {e}")
+        finally:
+            scheduler.release(node, job_time)
+
+    workers = sum(node.max_in_flight for node in nodes)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="comfyui-save") as executor:
+        n = 0
+        while True:
+            node = scheduler.acquire()
+            job = orderer.next(node.loaded_models)
+            if job is None:
+                scheduler.release(node)
+                break
+            n += 1
+            node.loaded_models = orderer.models_for(job)
+            print_step(n, total, f"Processing prompt ({job['workflow']}) on {node.address}", "🎨")
+            submitted = submit_job(config, templates[job['workflow']], job['workflow'], job, node.address, node.client_id)
+            if submitted is None:
+                scheduler.release(node)
+                continue
+            node.listener.watch(submitted['prompt_id'],
+                                lambda _pid, ok, err, node=node, s=submitted: executor.submit(finish, node, s, ok, err))
+
+        # Wait for every in-flight job to finish and its images to reach the disk
+        scheduler.wait_idle()
+        with counter_lock:
+            unsaved = list(pending_saves)
+        wait_for_futures(unsaved)
+
+    if len(nodes) > 1:
+        for node in nodes:
+            avg = node.average_job_time()
+            avg_str = f", avg {avg:.1f}s/job" if avg is not None else ""
+            print_info(f"Node {node.address}: {node.jobs_completed} jobs{avg_str}")
+    return images_generated, renders_done
+
+def workflow_list(workflow_name):
+    """Normalises a workflow name or list of names to a list of names."""
+    return [workflow_name] if isinstance(workflow_name, str) else list(workflow_name)
+
+def prepare_workflow(workflow_name, config):
+    """
+    Loads, validates and compiles a workflow for rendering.
+    
+    Returns:
+        tuple: (compiled template, websocket capture node ids or None), or (None, None) on failure
+    """
+    template = load_compiled_workflow(workflow_name)
+    if template is None:
+        return None, None
+    
+    # Validate workflow for required placeholders
+    is_valid, missing_required, missing_recommended = validate_workflow(template)
+    if not is_valid:
+        print_error(f"Workflow {workflow_name} is missing required placeholders: {missing_required}")
+        print_warning(f"Workflow {workflow_name} is missing recommended placeholders: {missing_recommended}")
+        return None, None
+
+    capture_nodes = None
+    if config['comfy_ui'].get('image_delivery') == 'websocket':
+        template, capture_nodes = websocket_delivery_template(template)
+        if not capture_nodes:
+            print_error(f"Workflow {workflow_name} has no SaveImage node to deliver images over the websocket.")
+            return None, None
+        print_info(f"Receiving {workflow_name} images over the websocket from node(s): {', '.join(capture_nodes)}")
+    if int(config['comfy_ui'].get('variations', 1)) > 1 and 'BATCH_SIZE' not in template['placeholders']:
+        print_warning(f"Workflow {workflow_name} has no {{BATCH_SIZE}} placeholder; it renders one image per prompt")
+    return template, capture_nodes
+
+def fan_out_jobs(jobs, workflow_names):
+    """Yields one render per workflow for each job; jobs already bound to a workflow pass through."""
+    for job in jobs:
+        if job.get('workflow'):
+            yield job
+            continue
+        for workflow_name in workflow_names:
+            yield {**job, "workflow": workflow_name}
+
+def render_jobs(jobs, total, config, workflow_name="flux_dev", nodes=None, stop_event=None):
+    """
+    Renders a stream of jobs with ComfyUI.
+    
+    Every job is rendered once through each of the given workflows, so a prompt
+    generated once can be compared across several models. Jobs that already carry
+    a 'workflow' key are only rendered through that workflow.
+    
+    Args:
+        jobs (iterable): Dicts with 'index', 'tags' and 'prompt'; may be a lazy generator
+        total (int): Expected number of renders (prompt x workflow), used for progress output
+        config (dict): Loaded configuration
+        workflow_name (str or list): Workflow(s) to render with
+        nodes (list): Already connected ComfyNodes to render on; they are left open afterwards
+        stop_event (threading.Event): Stops sending new jobs once set; queued prompts still finish
+        
+    Returns:
+        int: Number of images generated
+        
+    Raises:
+        GenerationError: If a workflow cannot be prepared or no ComfyUI server is reachable
+    """
+    output_dir = config['comfy_ui'].get('output_directory')
+    
+    print_info(f"Saving images to: {output_dir}")
+    
+    workflow_names = workflow_list(workflow_name)
+    templates = {}
+    models_by_workflow = {}
+    capture_nodes = set()
+    for name in workflow_names:
+        template, workflow_capture_nodes = prepare_workflow(name, config)
+        if template is None:
+            raise GenerationError(f"Workflow {name} could not be prepared")
+        templates[name] = template
+        models_by_workflow[name] = workflow_models(template)
+        capture_nodes.update(workflow_capture_nodes or [])
+    capture_nodes = sorted(capture_nodes) or None
+    if len(workflow_names) > 1:
+        print_info(f"Rendering every prompt through {len(workflow_names)} workflows: {', '.join(workflow_names)}")
+    
+    configure_http_client(config['comfy_ui'])
+    servers = get_comfy_servers(config['comfy_ui'])
+    if not servers:
+        raise GenerationError("ComfyUI 'server_address' (or 'servers') or 'workflow' not configured correctly.")
+
+    steps = config['comfy_ui'].get('steps', 20)
+    width = config['comfy_ui'].get('width', 1024)
+    height = config['comfy_ui'].get('height', 1024)
+
+    print_info(f"Starting image generation for {total} prompts")
+    variations = max(1, int(config['comfy_ui'].get('variations', 1)))
+    variations_str = f", {variations} variations per prompt" if variations > 1 else ""
+    print_info(f"Using parameters: width={width}, height={height}, steps={steps}{variations_str}")
+    images_generated = 0
+
+    # Group jobs that load the same models; a job list is known upfront and can be ordered as a whole
+    window = 1
+    if config['comfy_ui'].get('checkpoint_ordering', True) and len(set(models_by_workflow.values())) > 1:
+        window = total if isinstance(jobs, (list, tuple)) else int(config['comfy_ui'].get('checkpoint_window', 32))
+    orderer = CheckpointOrderer(fan_out_jobs(jobs, workflow_names), models_by_workflow, window, stop_event)
+
+    if nodes is not None:
+        for node in nodes:
+            node.listener.capture_nodes = set(capture_nodes or [])
+        images_generated, renders_done = _render_scheduled(nodes, orderer, total, config, templates)
+        orderer.report()
+        # Sessions stay open for the caller's next run, so these counts cover every run so far
+        report_http_pool_stats()
+        print_success(f"Finished ComfyUI processing. {renders_done}/{total} renders succeeded, "
+                      f"{images_generated} images saved! 🎉")
+        return images_generated
+
+    nodes = [ComfyNode(**server, capture_nodes=capture_nodes) for server in servers]
+    connected = [node for node in nodes if node.connect()]
+    if not connected:
+        if len(servers) == 1:
+            raise GenerationError(f"Could not connect to ComfyUI at {servers[0]['address']}")
+        raise GenerationError("Could not connect to any ComfyUI server")
+    if len(servers) > 1:
+        print_info(f"Distributing jobs across {len(connected)}/{len(servers)} ComfyUI nodes")
+    try:
+        images_generated, renders_done = _render_scheduled(connected, orderer, total, config, templates)
+    finally:
+        for node in connected:
+            node.close()
+
+    orderer.report()
+    report_http_pool_stats()
+    close_http_sessions()
+
+    print_success(f"Finished ComfyUI processing. {renders_done}/{total} renders succeeded, "
+                  f"{images_generated} images saved! 🎉")
+    return images_generated
+
+def make_job(index, tags, prompt, journal=None, workflow=None, on_image=None, prompt_time=None):
+    """
+    Creates a render job.
+    
+    Jobs carry their run journal so every stage can record progress, and an
+    optional on_image callback that receives a record for every saved image.
+    """
+    job = {"index": index, "tags": tags, "prompt": prompt, "created": time.time(), "timings": {"prompt": prompt_time}}
+    if workflow is not None:
+        job['workflow'] = workflow
+    if journal is not None:
+        job['journal'] = journal
+    if on_image is not None:
+        job['on_image'] = on_image
+    return job
+
+def generate_images_comfyui(prompts, config, tag_combinations=None, workflow_name="flux_dev", journal=None,
+                            nodes=None, stop_event=None, on_image=None, prompt_timings=None):
+    """Generates images for each prompt using ComfyUI."""
+    print_subheader("Generating Images with ComfyUI", "🖼️")
+    jobs = []
+    for i, prompt_text in enumerate(prompts):
+        if prompt_text is None:
+            continue # Prompt generation failed for this tag combination
+        tags = tag_combinations[i] if tag_combinations and i < len(tag_combinations) else ""
+        jobs.append(make_job(i, tags, prompt_text, journal, on_image=on_image,
+                             prompt_time=(prompt_timings or {}).get(i)))
+    return render_jobs(jobs, len(jobs) * len(workflow_list(workflow_name)), config, workflow_name, nodes, stop_event)
+
+# --- Run Journal ---
+# Per-job render parameters that replayed jobs carry instead of taking them from the run
+JOB_OVERRIDES = ("seed", "steps", "width", "height", "batch_size", "batch_index", "workflow", "source")
+
+class RunJournal:
+    """
+    Append-only JSONL record of a generation run, stored as output/<config>/runs/<run-id>.jsonl.
+    
+    Each job's tags, prompt, ComfyUI prompt_id and stage transitions are appended as
+    they happen, so a crashed run can be replayed with --resume: finished jobs are
+    skipped, generated prompts are reused and jobs still queued on ComfyUI are
+    picked up again.
+    """
+
+    def __init__(self, path, run_id):
+        self.path = path
+        self.run_id = run_id
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def path_for(output_dir, run_id):
+        return os.path.join(output_dir, "runs", f"{run_id}.jsonl")
+
+    @classmethod
+    def create(cls, output_dir):
+        random_str = ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=4))
+        run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{random_str}"
+        return cls(cls.path_for(output_dir, run_id), run_id)
+
+    def record(self, event, **fields):
+        """Appends one event and flushes it, so it survives a crash of this process."""
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **fields}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    @staticmethod
+    def replay(path):
+        """
+        Folds a journal file into the run's latest state.
+        
+        Returns:
+            dict: 'run' (run parameters), 'tags' / 'prompts' / 'overrides' (job index -> value), plus
+                  'queued', 'done' and 'failed', each mapping (job index, workflow) -> latest record
+        """
+        state = {"run": {}, "tags": {}, "prompts": {}, "overrides": {}, "queued": {}, "done": {}, "failed": {}}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # A line cut short by a crash
+                event = entry.get('event')
+                index = entry.get('index')
+                if event == 'run':
+                    state['run'] = entry
+                    continue
+                # Journals of single-workflow runs may not name the workflow on every event
+                run_workflows = workflow_list(state['run'].get('workflow') or [])
+                key = (index, entry.get('workflow') or (run_workflows[0] if len(run_workflows) == 1 else None))
+                if event == 'job':
+                    state['tags'][index] = entry.get('tags', "")
+                    overrides = {field: entry[field] for field in JOB_OVERRIDES if entry.get(field) is not None}
+                    if overrides:
+                        state['overrides'][index] = overrides
+                elif event == 'prompt':
+                    state['prompts'][index] = entry['prompt']
+                elif event == 'queued':
+                    state['queued'][key] = entry
+                    state['failed'].pop(key, None)
+                elif event == 'done':
+                    state['done'][key] = entry
+                    state['queued'].pop(key, None)
+                    state['failed'].pop(key, None)
+                elif event == 'failed':
+                    state['failed'][key] = entry
+                    state['queued'].pop(key, None)
+        return state
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list of numbers."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+class RunTrace:
+    """
+    Per-image stage timings of a run, appended to output/<config>/runs/<run-id>.trace.jsonl.
+    
+    Every saved image's record is written as one JSON line. Stage samples are kept
+    once per job (a batch of images shares its job's timings), so report() can print
+    p50/p95/max for each stage together with the run's images per minute. Count,
+    sum and max are exact; percentiles come from a reservoir of up to max_samples
+    jobs per stage, so memory stays bounded on very long runs.
+    """
+
+    STAGES = ("tags", "prompt", "queue", "render", "download", "metadata", "write", "total")
+
+    def __init__(self, path, max_samples=10000):
+        self.path = path
+        self.started = time.time()
+        self.images = 0
+        self.max_samples = max_samples
+        self.samples = {stage: [] for stage in self.STAGES}
+        self.totals = {stage: {"count": 0, "sum": 0.0, "max": 0.0} for stage in self.STAGES}
+        # Images of one batch arrive together, so only recent jobs need remembering
+        self._recent_jobs = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def path_for(output_dir, run_id):
+        return os.path.join(output_dir, "runs", f"{run_id}.trace.jsonl")
+
+    def record(self, image):
+        """Appends a saved image's timings to the trace."""
+        line = json.dumps({"time": round(time.time(), 3), "index": image['index'], "workflow": image['workflow'],
+                           "prompt_id": image['prompt_id'], "path": image['path'], "timings": image['timings']},
+                          ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.images += 1
+            job_key = (image['index'], image['workflow'], image['prompt_id'])
+            if job_key in self._recent_jobs:
+                return
+            self._recent_jobs[job_key] = True
+            if len(self._recent_jobs) > 1024:
+                self._recent_jobs.popitem(last=False)
+            for stage, seconds in image['timings'].items():
+                if seconds is None or stage not in self.samples:
+                    continue
+                totals = self.totals[stage]
+                totals['count'] += 1
+                totals['sum'] += seconds
+                totals['max'] = max(totals['max'], seconds)
+                samples = self.samples[stage]
+                if len(samples) < self.max_samples:
+                    samples.append(seconds)
+                else:
+                    # Reservoir sampling: every job so far is equally likely to be kept
+                    slot = random.randrange(totals['count'])
+                    if slot < self.max_samples:
+                        samples[slot] = seconds
+
+    def summary(self):
+        """
+        Returns:
+            dict: 'images', 'elapsed' (seconds), 'images_per_minute' and 'stages'
+                  (stage -> {'count', 'sum', 'p50', 'p95', 'max'}) for stages with samples
+        """
+        with self._lock:
+            elapsed = time.time() - self.started
+            stages = {
+                stage: {"count": self.totals[stage]['count'], "sum": round(self.totals[stage]['sum'], 3),
+                        "p50": percentile(values, 0.5), "p95": percentile(values, 0.95),
+                        "max": self.totals[stage]['max']}
+                for stage, values in self.samples.items() if values
+            }
+            return {"images": self.images, "elapsed": round(elapsed, 3),
+                    "images_per_minute": round(self.images * 60 / elapsed, 2) if elapsed > 0 else 0.0,
+                    "stages": stages}
+
+    def report(self):
+        summary = self.summary()
+        if not summary['images']:
+            return summary
+        print_header("Timing Summary")
+        print_info(f"{'stage':<10}{'p50':>9}{'p95':>9}{'max':>9}  (seconds per job)")
+        for stage, stats in summary['stages'].items():
+            print_info(f"{stage:<10}{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['max']:>9.2f}")
+        print_success(f"{summary['images']} images in {summary['elapsed']:.1f}s "
+                      f"({summary['images_per_minute']:.1f} images/minute)")
+        print_info(f"Timing trace: {self.path}")
+        return summary
+
+    def write_prometheus(self, path, labels=None):
+        """Writes the summary in the Prometheus text exposition format (e.g. for node_exporter's textfile collector)."""
+        summary = self.summary()
+        base = ",".join(f'{key}="{value}"' for key, value in (labels or {}).items())
+        def label_str(**extra):
+            pairs = [base] if base else []
+            pairs += [f'{key}="{value}"' for key, value in extra.items()]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+        lines = [
+            "# HELP imginarium_stage_seconds Seconds each job spent in a generation stage.",
+            "# TYPE imginarium_stage_seconds summary",
+        ]
+        for stage, stats in summary['stages'].items():
+            for quantile in ("0.5", "0.95"):
+                value = stats['p50'] if quantile == "0.5" else stats['p95']
+                lines.append(f"imginarium_stage_seconds{label_str(stage=stage, quantile=quantile)} {value}")
+            lines.append(f"imginarium_stage_seconds_sum{label_str(stage=stage)} {stats['sum']}")
+            lines.append(f"imginarium_stage_seconds_count{label_str(stage=stage)} {stats['count']}")
+        lines += ["# HELP imginarium_stage_seconds_max Longest time a job spent in a generation stage.",
+                  "# TYPE imginarium_stage_seconds_max gauge"]
+        lines += [f"imginarium_stage_seconds_max{label_str(stage=stage)} {stats['max']}"
+                  for stage, stats in summary['stages'].items()]
+        lines += ["# HELP imginarium_images_total Images saved by the run.",
+                  "# TYPE imginarium_images_total counter",
+                  f"imginarium_images_total{label_str()} {summary['images']}",
+                  "# HELP imginarium_images_per_minute Images saved per minute over the run.",
+                  "# TYPE imginarium_images_per_minute gauge",
+                  f"imginarium_images_per_minute{label_str()} {summary['images_per_minute']}"]
+        # Write and rename so a scraper never reads a half-written file
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def reattach_job(config, queued, job, poll_interval=1.0):
+    """
+    Picks up a job an earlier run queued on ComfyUI: waits while ComfyUI still has it
+    and saves its images once it shows up in the history.
+    
+    Returns:
+        int: Number of images saved; 0 if the job must be rendered again
+    """
+    server_address = queued['server']
+    prompt_id = queued['prompt_id']
+    if config['comfy_ui'].get('image_delivery') == 'websocket':
+        # Images pushed over the old connection are gone
+        return 0
+
+    submitted = {
+        "job": job,
+        "prompt_id": prompt_id,
+        "server_address": server_address,
+        "submitted_at": queued.get('time', time.time()),
+        "seed": queued['seed'],
+        "filename_prefix": queued['filename_prefix'],
+        "steps": queued['steps'],
+        "width": queued['width'],
+        "height": queued['height'],
+        "batch_size": queued.get('batch_size', 1),
+        "workflow": queued['workflow'],
+    }
+    while True:
+        history = get_history(prompt_id, server_address)
+        if history and prompt_id in history:
+            return complete_job(config, submitted).result()
+        queue_data = get_queue(server_address)
+        if queue_data is None:
+            return 0
+        queued_ids = {item[1] for item in queue_data.get('queue_running', []) + queue_data.get('queue_pending', [])
+                      if len(item) > 1}
+        if prompt_id not in queued_ids:
+            print_warning(f"prompt_id {prompt_id} is no longer known to {server_address}; rendering it again")
+            return 0
+        time.sleep(poll_interval)
+
+def resume_run(journal, state, config, workflow_name, model_override=None, model_provider=None, nodes=None,
+               stop_event=None, on_image=None):
+    """
+    Continues a journaled run: re-attaches to jobs still queued on ComfyUI, renders
+    jobs whose prompts were already generated and generates the missing prompts.
+    
+    Returns:
+        int: Number of images generated in this session
+    """
+    tags = state['tags']
+    overrides = state.get('overrides', {})
+    workflow_names = workflow_list(workflow_name)
+
+    def job_workflows(index):
+        workflow = overrides.get(index, {}).get('workflow')
+        return [workflow] if workflow else workflow_names
+
+    def resumed_job(index, prompt, workflow, prompt_time=None):
+        job = make_job(index, tags.get(index, ""), prompt, journal, workflow, on_image, prompt_time)
+        job.update({field: value for field, value in overrides.get(index, {}).items() if field != 'workflow'})
+        return job
+
+    done = set(state['done'])
+    total = sum(len(job_workflows(index)) for index in tags)
+    print_info(f"Resuming run {journal.run_id}: {len(done)}/{total} jobs already finished")
+    configure_http_client(config['comfy_ui'])
+
+    images_generated = 0
+    for (index, workflow), queued in sorted(state['queued'].items(), key=lambda item: item[0][0]):
+        print_info(f"Re-attaching to prompt_id {queued['prompt_id']} on {queued['server']}")
+        job = resumed_job(index, state['prompts'].get(index, ""), queued['workflow'])
+        num_saved = reattach_job(config, queued, job, config['comfy_ui'].get('queue_poll_interval', 1.0))
+        if num_saved:
+            done.add((index, workflow))
+            images_generated += num_saved
+
+    remaining = [(index, workflow) for index in sorted(tags) for workflow in job_workflows(index)
+                 if (index, workflow) not in done]
+    jobs = [resumed_job(index, state['prompts'][index], workflow)
+            for index, workflow in remaining if index in state['prompts']]
+    missing = sorted({index for index, _ in remaining if index not in state['prompts']})
+    if missing:
+        print_info(f"Generating {len(missing)} missing prompts")
+        prompt_timings = {}
+        prompts = generate_prompts_lm_studio([tags[index] for index in missing], config.get('lm_studio', {}), model_override,
+                                             model_provider=model_provider, timings=prompt_timings)
+        for position, prompt_text in enumerate(prompts):
+            if prompt_text is not None:
+                index = missing[position]
+                journal.record("prompt", index=index, prompt=prompt_text)
+                jobs.extend(resumed_job(index, prompt_text, workflow, prompt_timings.get(position))
+                            for i, workflow in remaining if i == index)
+        jobs.sort(key=lambda job: job['index'])
+
+    if not jobs:
+        print_success("Nothing left to render for this run.")
+        return images_generated
+    return images_generated + render_jobs(jobs, len(jobs), config, workflow_names, nodes, stop_event)
+
+# --- Replay ---
+def find_replay_images(paths=(), query=None, output_dir=None, limit=10):
+    """
+    Collects the images to render again, from explicit paths and/or a search of an output directory.
+    
+    A search matches images whose prompt and tags contain every word of the query,
+    newest first, up to `limit` images. Images without an embedded prompt are skipped.
+    
+    Returns:
+        list: (path, metadata) tuples
+    """
+    images = []
+    for path in paths:
+        metadata = read_metadata_from_image(path)
+        if not metadata.get('Prompt'):
+            print_warning(f"No prompt metadata in {path}; skipping it")
+            continue
+        images.append((path, metadata))
+    if query:
+        words = query.lower().split()
+        matches = [(path, metadata) for path, metadata in iter_library_metadata(output_dir)
+                   if metadata.get('Prompt')
+                   and all(word in f"{metadata['Prompt']} {metadata.get('Tags', '')}".lower() for word in words)]
+        matches.sort(key=lambda match: os.path.getmtime(match[0]), reverse=True)
+        print_info(f"Search '{query}' matched {len(matches)} images" + (f"; using the newest {limit}" if len(matches) > limit else ""))
+        images.extend(matches[:limit])
+    return images
+
+def make_replay_jobs(images, seeds=1, workflow_names=None, steps=None, width=None, height=None, journal=None,
+                     on_image=None):
+    """
+    Builds render jobs that reproduce images from their metadata, without LM Studio.
+    
+    Each image keeps its prompt, tags, seed, steps, dimensions and workflow unless
+    overridden. An image from a batch is rendered with its batch again and only
+    its own index is kept. With seeds > 1 it is rendered again with each of the following
+    seeds too (seed, seed+1, ...). Given workflow_names, every image is rendered
+    through each of them instead of its own workflow.
+    
+    Returns:
+        list: Jobs bound to a workflow, with their render parameters set
+    """
+    jobs = []
+    for path, metadata in images:
+        try:
+            base_seed = int(metadata.get('Seed'))
+        except (TypeError, ValueError):
+            base_seed = random.randint(1, MAX_SEED)
+        source_size = {}
+        for field in ('Steps', 'Width', 'Height', 'BatchSize', 'BatchIndex'):
+            try:
+                source_size[field] = int(metadata.get(field))
+            except (TypeError, ValueError):
+                source_size[field] = None
+        for workflow in workflow_names or [metadata.get('Workflow')]:
+            for offset in range(seeds):
+                index = len(jobs)
+                job = make_job(index, metadata.get('Tags', ""), metadata['Prompt'], journal, workflow, on_image)
+                job.update({
+                    "seed": (base_seed - 1 + offset) % MAX_SEED + 1,
+                    "steps": steps or source_size['Steps'],
+                    "width": width or source_size['Width'],
+                    "height": height or source_size['Height'],
+                    "source": os.path.basename(path),
+                })
+                if (source_size['BatchSize'] or 1) > 1 and source_size['BatchIndex'] is not None:
+                    # A batch image only comes back from the same seed with the same batch size
+                    job.update({"batch_size": source_size['BatchSize'], "batch_index": source_size['BatchIndex']})
+                jobs.append(job)
+    return jobs
+
+# --- Pipelined Generation ---
+_PIPELINE_DONE = object()
+
+def run_pipeline(tag_combinations, config, workflow_name="flux_dev", model_override=None, queue_size=4, journal=None,
+                 model_provider=None, nodes=None, cancel_event=None, on_image=None, dedup=None, total=None):
+    """
+    Streams prompts from LM Studio straight into ComfyUI.
+    
+    A producer thread generates prompts and hands each one to the render stage
+    through a bounded queue, so the first image starts after a single LLM call
+    and prompt generation keeps running while ComfyUI renders.
+    
+    model_provider and nodes let a long-running caller supply a resident LM Studio
+    model and open ComfyUI connections; cancel_event stops the run early and
+    on_image receives a record for every saved image. tag_combinations may be a
+    lazy iterator of `total` items, so nothing grows with the size of the run.
+    
+    Returns:
+        int: Number of images generated
+    """
+    if total is None:
+        total = len(tag_combinations)
+    print_subheader("Generating Images (pipelined LM Studio -> ComfyUI)", "🚀")
+    print_info(f"Pipeline queue size: {queue_size}")
+    prompt_queue = queue.Queue(maxsize=max(1, queue_size))
+    stop_event = threading.Event()
+    producer_errors = []
+
+    def put(item):
+        # Block while the queue is full, but give up if the consumer has stopped
+        while not stop_event.is_set():
+            try:
+                prompt_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        prompt_timings = {}
+        try:
+            for i, tags, prompt_text in iter_prompts_lm_studio(tag_combinations, config.get('lm_studio', {}),
+                                                               model_override, stop_event, model_provider,
+                                                               prompt_timings, dedup, total):
+                if journal is not None:
+                    journal.record("prompt", index=i, prompt=prompt_text)
+                if not put(make_job(i, tags, prompt_text, journal, on_image=on_image,
+                                    prompt_time=prompt_timings.pop(i, None))):
+                    break
+        except Exception as e:
+            producer_errors.append(e)
+            print_error(f"Prompt generation stopped: {e}")
+        finally:
+            put(_PIPELINE_DONE)
+
+    def consume():
+        while True:
+            item = prompt_queue.get()
+            if item is _PIPELINE_DONE:
+                return
+            yield item
+
+    producer = threading.Thread(target=produce, name="lm-studio-producer", daemon=True)
+    producer.start()
+    try:
+        images_generated = render_jobs(consume(), total * len(workflow_list(workflow_name)),
+                                       config, workflow_name, nodes, cancel_event)
+    finally:
+        stop_event.set()
+        producer.join()
+    return images_generated
+
+# --- Library API ---
+def format_duration(seconds):
+    """Formats seconds as e.g. '2h05m', '4m10s' or '12s'."""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+class ProgressReporter:
+    """Prints one progress line at most every `interval` seconds, for runs too long to log every item."""
+
+    def __init__(self, total, interval=10.0):
+        self.total = total
+        self.interval = interval
+        self.started = time.time()
+        self.images = 0
+        self.jobs = 0
+        self._last_print = self.started
+        self._recent_jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def image_saved(self, job_key):
+        with self._lock:
+            self.images += 1
+            if job_key not in self._recent_jobs:
+                self.jobs += 1
+                self._recent_jobs[job_key] = True
+                if len(self._recent_jobs) > 1024:
+                    self._recent_jobs.popitem(last=False)
+            now = time.time()
+            if now - self._last_print < self.interval:
+                return
+            self._last_print = now
+        self._print(now)
+
+    def _print(self, now):
+        elapsed = max(now - self.started, 1e-6)
+        rate = self.images * 60 / elapsed
+        eta = ""
+        if self.jobs and self.total:
+            eta = f", ETA {format_duration((self.total - self.jobs) * elapsed / self.jobs)}"
+        percent = f" ({100 * self.jobs / self.total:.1f}%)" if self.total else ""
+        print(f"{get_emoji('rocket')} [{self.jobs:,}/{self.total:,}]{percent} {self.images:,} images in "
+              f"{format_duration(elapsed)}, {rate:.1f} images/minute{eta}", flush=True)
+
+    def finish(self):
+        self._print(time.time())
+
+def parse_dimensions(dimensions):
+    """
+    Parses a "WIDTHxHEIGHT" string.
+    
+    Raises:
+        GenerationError: If the string is malformed or not positive
+    """
+    try:
+        if 'x' not in dimensions:
+            raise ValueError("Size must be in format WIDTHxHEIGHT (e.g., 1920x1080)")
+        width, height = map(int, dimensions.split('x'))
+        if width <= 0 or height <= 0:
+            raise ValueError("Width and height must be positive integers")
+    except ValueError as e:
+        raise GenerationError(f"Invalid size format: {e}")
+    return width, height
+
+class ResourcePool:
+    """Keeps LM Studio models loaded and ComfyUI nodes connected between runs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.models = {}   # model name -> [model handle, last used]
+        self.nodes = {}    # server address -> ComfyNode
+
+    def get_model(self, lm_config, model_name):
+        """Returns the resident model, loading it on first use."""
+        with self._lock:
+            entry = self.models.get(model_name)
+            if entry is not None:
+                entry[1] = time.time()
+                return entry[0]
+        model = load_lm_model(lm_config, model_name)
+        if model is not None:
+            with self._lock:
+                self.models[model_name] = [model, time.time()]
+        return model
+
+    def touch_models(self):
+        with self._lock:
+            for entry in self.models.values():
+                entry[1] = time.time()
+
+    def unload_idle_models(self, idle_timeout):
+        with self._lock:
+            idle = [name for name, (_, last_used) in self.models.items() if time.time() - last_used > idle_timeout]
+            models = [(name, self.models.pop(name)[0]) for name in idle]
+        for name, model in models:
+            print_info(f"Model {name} idle for {idle_timeout}s")
+            unload_lm_model(model, name)
+
+    def get_nodes(self, comfy_config):
+        """Returns connected ComfyNodes for the configured servers, reconnecting dropped ones."""
+        nodes = []
+        for server in get_comfy_servers(comfy_config):
+            node = self.nodes.get(server['address'])
+            if node is None or node.listener is None or not node.listener.is_alive():
+                if node is not None:
+                    node.close()
+                node = ComfyNode(**server)
+                if not node.connect():
+                    self.nodes.pop(server['address'], None)
+                    continue
+                self.nodes[server['address']] = node
+            node.max_in_flight = server['max_in_flight']
+            node.target_queue_depth = server['target_queue_depth']
+            nodes.append(node)
+        return nodes
+
+    def close(self):
+        with self._lock:
+            models = list(self.models.items())
+            self.models.clear()
+        for name, (model, _) in models:
+            unload_lm_model(model, name)
+        for node in self.nodes.values():
+            node.close()
+        self.nodes.clear()
+        close_image_writers()
+        close_thumbnail_pool()
+        close_http_sessions()
+
+class Generator:
+    """
+    Importable generation API: renders images for a loaded config and yields each one as it is saved.
     
-    # Default values for workflow placeholders
-    default_negative_prompt = "text, watermark, signature, blurry, distorted, low resolution, poorly drawn, bad anatomy, deformed, disfigured, out of frame, cropped"
+    Example:
+        from generate import Generator, load_config
+        
+        with Generator(load_config("configs/stock.yaml"), "stock", workflow=["sd_xl", "flux_dev"]) as generator:
+            for image in generator.generate(10):
+                print(image['path'], image['timings'])
     
-    if not server_address or not client_id or not workflow_str:
-        print_error("ComfyUI 'server_address', 'client_id', or 'workflow' not configured correctly.")
-        return
+    Each yielded record holds the image 'path', its 'metadata', the job 'index',
+    'workflow' and 'prompt_id', and 'timings' in seconds for the 'tags', 'prompt',
+    'queue', 'render' and 'save' stages ('save' split into 'download', 'metadata'
+    and 'write') plus the 'total'. Timings are also appended to the run's trace
+    file and summarised when the run ends; with metrics_path the summary is
+    written there in the Prometheus text format.
+    
+    With stream=True, tag combinations are drawn lazily and flow through the
+    pipeline one at a time, so memory stays flat for any num_images, and per-item
+    output is replaced by a progress line every progress_interval seconds.
+    
+    The LM Studio model and ComfyUI connections are opened on first use and kept
+    until close(), so repeated runs skip model loading. Failures raise GenerationError instead of exiting.
+    """
 
-    print_info(f"Connecting to ComfyUI WebSocket at ws://{server_address}/ws?clientId={client_id}")
-    ws = None
-    try:
-        ws = websocket.WebSocket()
-        ws.connect(f"ws://{server_address}/ws?clientId={client_id}")
-        print_success("Connected to ComfyUI WebSocket!")
-    except Exception as e:
-        print_error(f"Error connecting to ComfyUI WebSocket: {e}")
-        return
+    def __init__(self, config, config_name, workflow=None, model=None, width=None, height=None, steps=None,
+                 pipeline=True, queue_size=4, output_dir=None, resources=None, cancel_event=None, metrics_path=None,
+                 stream=False, progress_interval=10.0, variations=None, image_delivery=None):
+        self.config = config
+        self.config_name = config_name
+        self.workflow = workflow_list(workflow) if workflow else None
+        self.model = model
+        self.width = width
+        self.height = height
+        self.steps = steps
+        self.variations = variations
+        self.image_delivery = image_delivery
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+        self.output_dir = output_dir or os.path.join("output", config_name)
+        self.metrics_path = metrics_path
+        self.stream = stream
+        self.progress_interval = progress_interval
+        self.resources = resources or ResourcePool()
+        self._owns_resources = resources is None
+        self._cancel_event = cancel_event
+        self._active_cancel = None
+        self.run_id = None
+        for workflow_name in self.workflow or []:
+            self._check_workflow(workflow_name)
 
-    print_info(f"Starting image generation for {len(prompts)} prompts")
-    print_info(f"Using parameters: width={width}, height={height}, steps={steps}")
-    images_generated = 0
+    def __enter__(self):
+        return self
 
-    for i, prompt_text in enumerate(prompts):
-        print_step(i+1, len(prompts), "Processing prompt", "🎨")
-        # Print the full prompt
-        print_info(f"Prompt: {prompt_text}")
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _check_workflow(workflow_name):
+        workflow_path = resolve_workflow_path(workflow_name)
+        if workflow_path is None:
+            print_info(f"Make sure the workflow file exists in the 'workflows' directory (with or without .wf extension)")
+            raise GenerationError(f"Workflow file not found: {workflow_name}")
+        try:
+            with open(workflow_path, 'r') as f:
+                workflow_str = f.read()
+            # Validate workflow for required and recommended placeholders
+            is_valid, missing_required, missing_recommended = validate_workflow(workflow_str)
+        except (OSError, ValueError) as e:
+            raise GenerationError(f"Error loading or validating workflow {workflow_name}: {e}")
+        if not is_valid:
+            raise GenerationError(f"Workflow {workflow_name} validation failed! Missing required placeholders: "
+                                  f"{', '.join(missing_required)}")
+        if missing_recommended:
+            print_warning(f"Workflow {workflow_name} is missing recommended placeholders: {', '.join(missing_recommended)}")
+            print_warning("The workflow will still run, but some features may not work as expected.")
+
+    def _prepare(self, run_info=None, llm=True):
+        """Builds this run's config; explicit arguments win over an earlier run's parameters, which win over the config."""
+        run_info = run_info or {}
+        config = copy.deepcopy(self.config)
+        comfy_config = config.setdefault('comfy_ui', {})
+        lm_config = config.setdefault('lm_studio', {})
+        os.makedirs(self.output_dir, exist_ok=True)
+        comfy_config['output_directory'] = self.output_dir
+
+        workflow_names = self.workflow or (workflow_list(run_info['workflow']) if run_info.get('workflow') else None)
+        if workflow_names is None:
+            workflow_names = [comfy_config.get('default_workflow', 'flux_dev')]
+            self._check_workflow(workflow_names[0])
+        elif not self.workflow:
+            for workflow_name in workflow_names:
+                self._check_workflow(workflow_name)
+        print_info(f"Using workflow{'s' if len(workflow_names) > 1 else ''}: {', '.join(workflow_names)}")
+
+        width = self.width or run_info.get('width')
+        height = self.height or run_info.get('height')
+        if width and height:
+            print_info(f"Overriding image dimensions: {width}x{height}")
+            comfy_config['width'] = width
+            comfy_config['height'] = height
+        else:
+            print_info(f"Using dimensions from config: {comfy_config.get('width', 1536)}x{comfy_config.get('height', 1536)}")
+
+        steps = self.steps or run_info.get('steps')
+        if steps:
+            print_info(f"Overriding steps count: {steps}")
+        else:
+            steps = comfy_config.get('steps', 35)
+            print_info(f"Using steps from config: {steps}")
+        comfy_config['steps'] = steps
 
-        # Create a copy of the workflow string for this prompt
-        current_workflow_str = workflow_str
+        variations = self.variations or run_info.get('variations')
+        if variations:
+            comfy_config['variations'] = variations
+        image_delivery = self.image_delivery or run_info.get('image_delivery')
+        if image_delivery:
+            comfy_config['image_delivery'] = image_delivery
+
+        model_name = self.model or run_info.get('model') or lm_config.get('model', 'gemma-3-4b-it')
+        if llm:
+            print_info(f"Using model: {model_name}")
+        return config, workflow_names, model_name
+
+    def _connect(self, config):
+        configure_http_client(config['comfy_ui'])
+        nodes = self.resources.get_nodes(config['comfy_ui'])
+        if not nodes:
+            raise GenerationError("Could not connect to any ComfyUI server")
+        return nodes
+
+    def generate(self, num_images=5, tag_combinations=None):
+        """
+        Starts a run and returns an iterator over the images as they are saved.
         
-        # Generate a random seed for this prompt
-        random_seed = random.randint(1, 2147483647)
+        Args:
+            num_images (int): Number of tag combinations (prompts) to generate
+            tag_combinations (list): Tag strings to use instead of sampling them from the config
+            
+        Raises:
+            GenerationError: If the run cannot be set up; raised again from the iterator if it fails later
+        """
+        config, workflow_names, model_name = self._prepare()
+        sampling_started = time.time()
+        if tag_combinations is None:
+            mode = config.get('tag_sampling', 'random')
+            existing_tags = ()
+            if mode == 'fill-gaps':
+                existing_tags = (metadata.get('Tags', "") for _, metadata in iter_library_metadata(self.output_dir))
+            sample = iter_tag_combinations if self.stream else generate_tag_combinations
+            tag_combinations = sample(config.get('tags', {}), num_images, mode, existing_tags)
+        elif self.stream:
+            tag_combinations = iter(tag_combinations)
+        if not self.stream and not tag_combinations:
+            raise GenerationError("No tag combinations generated")
+
+        journal = RunJournal.create(self.output_dir)
+        if self.stream:
+            # Tags are drawn as the LLM asks for them; each is journaled when drawn
+            sampling = {"seconds": 0.0, "count": 0}
+            total = num_images
+
+            def journaled(combinations):
+                for i in itertools.count():
+                    started = time.time()
+                    tags = next(combinations, None)
+                    if tags is None:
+                        return
+                    sampling['seconds'] += time.time() - started
+                    sampling['count'] += 1
+                    journal.record("job", index=i, tags=tags)
+                    yield tags
+
+            tag_combinations = journaled(tag_combinations)
+            tag_time = lambda: round(sampling['seconds'] / max(1, sampling['count']), 3)
+        else:
+            total = len(tag_combinations)
+            tag_time = round((time.time() - sampling_started) / total, 3)
+        self.run_id = journal.run_id
+        print_info(f"Run ID: {journal.run_id} (resume with --resume {journal.run_id})")
+        journal.record("run", run_id=journal.run_id, config=self.config_name, workflow=workflow_names,
+                       model=model_name, steps=config['comfy_ui']['steps'],
+                       width=config['comfy_ui'].get('width'), height=config['comfy_ui'].get('height'),
+                       variations=max(1, int(config['comfy_ui'].get('variations', 1))),
+                       image_delivery=config['comfy_ui'].get('image_delivery', 'http'),
+                       num_images=total, stream=self.stream)
+        if not self.stream:
+            for i, tags in enumerate(tag_combinations):
+                journal.record("job", index=i, tags=tags)
+
+        model_provider = lambda: self.resources.get_model(config['lm_studio'], model_name)
+        dedup = make_prompt_deduplicator(config['lm_studio'], self.output_dir)
+
+        def work(on_image, cancel_event):
+            nodes = self._connect(config)
+            if self.pipeline or self.stream:
+                # Stream prompts from LM Studio into ComfyUI as they are produced
+                run_pipeline(tag_combinations, config, workflow_names, model_name, self.queue_size, journal,
+                             model_provider, nodes, cancel_event, on_image, dedup, total)
+            else:
+                prompt_timings = {}
+                prompts = generate_prompts_lm_studio(tag_combinations, config['lm_studio'], model_name, journal,
+                                                     model_provider, prompt_timings, dedup)
+                if not any(prompt is not None for prompt in prompts):
+                    raise GenerationError("No prompts generated by LM Studio")
+                generate_images_comfyui(prompts, config, tag_combinations, workflow_names, journal,
+                                        nodes, cancel_event, on_image, prompt_timings)
+
+        report = (lambda: dedup.report(len(workflow_names))) if dedup is not None else None
+        return self._stream(work, journal, tag_time, total * len(workflow_names), report)
+
+    def resume(self, run_id):
+        """
+        Continues an interrupted run from its journal and returns an iterator over the newly saved images.
         
-        # Create a custom filename based on tags if available
-        custom_filename = f"image_{i+1}"
-        if tag_combinations and i < len(tag_combinations):
-            custom_filename = tags_to_filename(tag_combinations[i])
-            # Truncate the displayed filename if it's too long
-            display_filename = custom_filename
-            if len(display_filename) > 40:
-                display_filename = display_filename[:20] + "..." + display_filename[-17:]
-            print_info(f"Using filename based on tags: {display_filename}")
+        Raises:
+            GenerationError: If the run's journal does not exist
+        """
+        journal_path = RunJournal.path_for(self.output_dir, run_id)
+        if not os.path.exists(journal_path):
+            raise GenerationError(f"Run journal not found: {journal_path}")
+        state = RunJournal.replay(journal_path)
+        undrawn = state['run'].get('num_images', 0) - len(state['tags'])
+        if state['run'].get('stream') and undrawn > 0:
+            print_warning(f"{undrawn:,} tag combinations of this streaming run were never drawn; start a new run "
+                          f"for them (--sampling fill-gaps skips combinations already in the library)")
+        config, workflow_names, model_name = self._prepare(state['run'], llm=not state['run'].get('replay'))
+        journal = RunJournal(journal_path, run_id)
+        self.run_id = run_id
+        model_provider = lambda: self.resources.get_model(config['lm_studio'], model_name)
+
+        def work(on_image, cancel_event):
+            resume_run(journal, state, config, workflow_names, model_name, model_provider,
+                       self._connect(config), cancel_event, on_image)
+
+        return self._stream(work, journal)
+
+    def replay(self, image_paths=(), query=None, seeds=1, limit=10):
+        """
+        Renders existing images again from their embedded metadata and returns an iterator over the new images.
         
-        # Add workflow name as prefix to the filename
-        custom_filename = f"{workflow_name}_{custom_filename}"
-        print_info(f"Final filename with workflow prefix: {custom_filename}")
+        Prompts, tags, seeds, steps, dimensions and workflows come from the PNG text
+        chunks; the workflow, width, height and steps given to the Generator override
+        them. LM Studio is never loaded, so the jobs reach ComfyUI within seconds.
         
-        # Replace placeholders in the workflow string
-        # Note: We're directly substituting the values, not as JSON strings
-        # Use replace() with no count limit to replace all occurrences of each placeholder
-        current_workflow_str = current_workflow_str.replace('"{PROMPT}"', json.dumps(prompt_text))
-        current_workflow_str = current_workflow_str.replace('"{NEGATIVE_PROMPT}"', json.dumps(default_negative_prompt))
-        current_workflow_str = current_workflow_str.replace('{NEGATIVE_PROMPT}', default_negative_prompt)  # For direct text fields
-        current_workflow_str = current_workflow_str.replace('{PROMPT}', prompt_text)  # For direct text fields
-        current_workflow_str = current_workflow_str.replace('{SEED}', str(random_seed))
-        current_workflow_str = current_workflow_str.replace('{STEPS}', str(steps))
-        current_workflow_str = current_workflow_str.replace('{WIDTH}', str(width))
-        current_workflow_str = current_workflow_str.replace('{HEIGHT}', str(height))
+        Args:
+            image_paths (list): PNG files to replay
+            query (str): Also replay the newest `limit` images of this config whose prompt or tags match
+            seeds (int): Renders per image and workflow, sweeping seed, seed+1, ...
+            
+        Raises:
+            GenerationError: If no image with prompt metadata was found
+        """
+        images = find_replay_images(image_paths, query, self.output_dir, limit)
+        if not images:
+            raise GenerationError("No images with prompt metadata to replay")
+        default_workflow = self.config.get('comfy_ui', {}).get('default_workflow', 'flux_dev')
+        if not self.workflow:
+            images = [(path, {**metadata, "Workflow": metadata.get('Workflow') or default_workflow})
+                      for path, metadata in images]
+        workflow_names = list(self.workflow or dict.fromkeys(metadata['Workflow'] for _, metadata in images))
+        for workflow_name in list(workflow_names):
+            if resolve_workflow_path(workflow_name) is None:
+                print_warning(f"Workflow {workflow_name} not found; skipping the images made with it")
+                workflow_names.remove(workflow_name)
+        if not workflow_names:
+            raise GenerationError("None of the images' workflows exist in the workflows directory")
+        images = [(path, metadata) for path, metadata in images if self.workflow or metadata['Workflow'] in workflow_names]
+
+        config, workflow_names, _ = self._prepare({"workflow": workflow_names}, llm=False)
+        journal = RunJournal.create(self.output_dir)
+        self.run_id = journal.run_id
+        jobs = make_replay_jobs(images, max(1, seeds), self.workflow, self.steps, self.width, self.height, journal)
+        print_info(f"Replaying {len(images)} images as {len(jobs)} renders")
+        print_info(f"Run ID: {journal.run_id} (resume with --resume {journal.run_id})")
+        journal.record("run", run_id=journal.run_id, config=self.config_name, workflow=workflow_names,
+                       steps=config['comfy_ui']['steps'], width=config['comfy_ui'].get('width'),
+                       height=config['comfy_ui'].get('height'),
+                       variations=max(1, int(config['comfy_ui'].get('variations', 1))),
+                       image_delivery=config['comfy_ui'].get('image_delivery', 'http'),
+                       num_images=len(jobs), replay=True)
+        for job in jobs:
+            journal.record("job", index=job['index'], tags=job['tags'],
+                           **{field: job[field] for field in JOB_OVERRIDES if job.get(field) is not None})
+            journal.record("prompt", index=job['index'], prompt=job['prompt'])
+
+        def work(on_image, cancel_event):
+            for job in jobs:
+                job['on_image'] = on_image
+            render_jobs(jobs, len(jobs), config, workflow_names, self._connect(config), cancel_event)
+
+        return self._stream(work, journal)
+
+    def _stream(self, work, journal, tag_time=None, total=None, report=None):
+        records = queue.Queue()
+        cancel_event = self._cancel_event or threading.Event()
+        self._active_cancel = cancel_event
+        errors = []
+        trace = RunTrace(RunTrace.path_for(self.output_dir, journal.run_id))
+        progress = ProgressReporter(total, self.progress_interval) if self.stream and total else None
+
+        def on_image(record):
+            # Tag sampling happens once per run; each job is charged its share
+            record['timings'] = {"tags": tag_time() if callable(tag_time) else tag_time, **record['timings']}
+            trace.record(record)
+            if progress is not None:
+                progress.image_saved((record['index'], record['workflow'], record['prompt_id']))
+            records.put(record)
+
+        def run():
+            if progress is not None:
+                set_quiet_mode(True)
+            try:
+                work(on_image, cancel_event)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                if progress is not None:
+                    set_quiet_mode(False)
+                    progress.finish()
+                if report is not None:
+                    report()
+                journal.close()
+                trace.close()
+                trace.report()
+                if self.metrics_path:
+                    try:
+                        trace.write_prometheus(self.metrics_path, {"config": self.config_name})
+                        print_info(f"Metrics written to {self.metrics_path}")
+                    except OSError as e:
+                        print_error(f"Could not write metrics to {self.metrics_path}: {e}")
+                self.resources.touch_models()
+                records.put(_PIPELINE_DONE)
+
+        thread = threading.Thread(target=run, name="generator", daemon=True)
+        thread.start()
+        try:
+            while True:
+                record = records.get()
+                if record is _PIPELINE_DONE:
+                    break
+                yield record
+        finally:
+            if thread.is_alive():
+                # The caller stopped early: send no more prompts and let queued ones finish
+                print_info("Stopping after the prompts already queued on ComfyUI finish...")
+                cancel_event.set()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    async def agenerate(self, num_images=5, tag_combinations=None):
+        """Async variant of generate(): yields the same records without blocking the event loop."""
+        iterator = self.generate(num_images, tag_combinations)
+        try:
+            while True:
+                record = await asyncio.to_thread(next, iterator, _PIPELINE_DONE)
+                if record is _PIPELINE_DONE:
+                    return
+                yield record
+        finally:
+            await asyncio.to_thread(iterator.close)
+
+    def cancel(self):
+        """Stops the current run from sending further prompts; prompts already queued still finish."""
+        if self._active_cancel is not None:
+            self._active_cancel.set()
+
+    def close(self):
+        """Unloads the LM Studio model and closes ComfyUI connections, unless they belong to a shared ResourcePool."""
+        if self._owns_resources:
+            self.resources.close()
+
+# --- Daemon Mode ---
+class GenerationDaemon:
+    """
+    Long-running generation service that keeps models and connections warm between batches.
+    
+    Submitted jobs run one at a time on a worker thread through a Generator.
+    LM Studio models stay loaded while there is work and are unloaded after
+    idle_timeout seconds without any; ComfyUI websockets and HTTP sessions stay
+    open for the daemon's lifetime. Parsed configs are reused until their YAML
+    file changes.
+    """
+
+    def __init__(self, idle_timeout=300, queue_size=4):
+        self.idle_timeout = idle_timeout
+        self.queue_size = queue_size
+        self.resources = ResourcePool()
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._jobs = {}
+        self._cancel_events = {}
+        self._configs = {}  # config path -> (mtime, parsed config)
+        self._current = None
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="generation-daemon", daemon=True)
+        self._reaper = threading.Thread(target=self._reap_idle_models, name="model-reaper", daemon=True)
+
+    def start(self):
+        self._worker.start()
+        self._reaper.start()
+        return self
+
+    def submit(self, request):
+        """
+        Queues a generation request.
         
-        # Replace the filename placeholder with our custom filename
-        # This works with any workflow that uses the {FILENAME_PREFIX} placeholder
-        current_workflow_str = current_workflow_str.replace('"{FILENAME_PREFIX}"', json.dumps(custom_filename))
+        Args:
+            request (dict): 'config' (required), 'num_images', 'workflow' (name or list),
+                            'dimensions' ("WIDTHxHEIGHT") or 'width'/'height', 'steps', 'model'
         
-        # Parse the string into a JSON object
+        Returns:
+            dict: The new job's status
+            
+        Raises:
+            GenerationError: If the request is invalid
+        """
+        config_name = request.get('config')
+        if not config_name or not os.path.exists(os.path.join("configs", f"{config_name}.yaml")):
+            raise GenerationError(f"Unknown config: {config_name}")
         try:
-            current_workflow = json.loads(current_workflow_str)
-        except json.JSONDecodeError as e:
-            print_error(f"Error parsing workflow JSON: {e}")
-            print_warning("Skipping this prompt.")
-            continue
-        
-        print_info(f"Using seed: {random_seed}, steps: {steps}, dimensions: {width}x{height}")
-        print_info(f"Negative prompt: {default_negative_prompt[:50]}...")
-
-        # Queue the modified workflow
-        queued_data = queue_prompt(current_workflow, client_id, server_address)
-        if queued_data and 'prompt_id' in queued_data:
-            prompt_id = queued_data['prompt_id']
-            print_info(f"Starting generation...")
-            # Wait for results and get image via WebSocket
-            if get_images_from_websocket(ws, server_address, client_id, output_dir, prompt_id):
-                 images_generated += 1
-                 print_success(f"Successfully generated image {images_generated}! 🎉")
-                 
-                 # Get the actual filename that was saved
-                 filename = f"{custom_filename}_00001_.png"  # Default format from ComfyUI
-                 file_path = os.path.join(output_dir, filename)
-                 
-                 # Add metadata to the PNG image
-                 if tag_combinations and i < len(tag_combinations):
-                     tag_string = tag_combinations[i]
-                 else:
-                     tag_string = ""
-                     
-                 metadata = {
-                     "Prompt": prompt_text,
-                     "Tags": tag_string,
-                     "Seed": random_seed,
-                     "Steps": steps,
-                     "Width": width,
-                     "Height": height,
-                     "Workflow": workflow_name,
-                     "Ratio": round(width/height, 2),
-                     "Generator": "Stock Image Generator",
-                     "Created": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                 }
-                 add_metadata_to_image(file_path, metadata)
-            else:
-                print_error(f"Failed to get image for prompt_id {prompt_id}.")
-        else:
-            print_error("Failed to queue prompt in ComfyUI.")
+            num_images = int(request.get('num_images', 5))
+            steps = int(request['steps']) if request.get('steps') else None
+            width, height = request.get('width'), request.get('height')
+            if request.get('dimensions'):
+                width, height = parse_dimensions(str(request['dimensions']))
+            width, height = (int(width), int(height)) if width and height else (None, None)
+        except (TypeError, ValueError) as e:
+            raise GenerationError(f"Invalid request: {e}")
+        if num_images <= 0:
+            raise GenerationError("num_images must be a positive integer")
+        if (width is not None and width <= 0) or (height is not None and height <= 0):
+            raise GenerationError("Width and height must be positive integers")
+        workflows = workflow_list(request['workflow']) if request.get('workflow') else None
+        for workflow_name in workflows or []:
+            if resolve_workflow_path(workflow_name) is None:
+                raise GenerationError(f"Workflow file not found: {workflow_name}")
+
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "config": config_name,
+            "num_images": num_images,
+            "workflow": workflows,
+            "width": width,
+            "height": height,
+            "steps": steps,
+            "model": request.get('model'),
+            "run_id": None,
+            "images_generated": 0,
+            "error": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._cancel_events[job_id] = threading.Event()
+        self._pending.put(job_id)
+        print_info(f"Queued daemon job {job_id}: {num_images} images from '{config_name}'")
+        return self.describe(job_id)
+
+    def describe(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """Cancels a queued job, or stops a running one from sending further prompts."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == 'queued':
+                job['status'] = 'cancelled'
+                job['finished'] = time.time()
+            elif job['status'] == 'running':
+                job['status'] = 'cancelling'
+                self._cancel_events[job_id].set()
+            return dict(job)
+
+    def status(self):
+        with self._lock:
+            return {
+                "current": self._current,
+                "queued": sum(1 for job in self._jobs.values() if job['status'] == 'queued'),
+                "models": sorted(self.resources.models),
+                "idle_timeout": self.idle_timeout,
+                "nodes": [{"address": node.address, "connected": node.listener is not None and node.listener.is_alive(),
+                           "in_flight": node.in_flight, "jobs_completed": node.jobs_completed}
+                          for node in self.resources.nodes.values()],
+            }
+
+    def _load_config(self, config_name):
+        config_path = os.path.join("configs", f"{config_name}.yaml")
+        mtime = os.path.getmtime(config_path)
+        cached = self._configs.get(config_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, load_config(config_path))
+            self._configs[config_path] = cached
+        return cached[1]
 
-        time.sleep(1) # Small delay between queuing prompts
+    def _execute(self, job, cancel_event):
+        generator = Generator(self._load_config(job['config']), job['config'], job['workflow'], job['model'],
+                              job['width'], job['height'], job['steps'], queue_size=self.queue_size,
+                              resources=self.resources, cancel_event=cancel_event)
+        images = generator.generate(job['num_images'])
+        with self._lock:
+            job['run_id'] = generator.run_id
+        for _ in images:
+            with self._lock:
+                job['images_generated'] += 1
 
-    ws.close()
-    print_success(f"Finished ComfyUI processing. {images_generated}/{len(prompts)} images generated successfully! 🎉")
+    def _run(self):
+        while not self._stopped.is_set():
+            job_id = self._pending.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self._jobs[job_id]
+                if job['status'] != 'queued':
+                    continue
+                job['status'] = 'running'
+                job['started'] = time.time()
+                self._current = job_id
+            cancel_event = self._cancel_events[job_id]
+            print_subheader(f"Daemon job {job_id}", "🚀")
+            status, error = 'done', None
+            try:
+                self._execute(job, cancel_event)
+            except Exception as e:
+                status, error = 'failed', str(e) or type(e).__name__
+                print_error(f"Daemon job {job_id} failed: {error}")
+            with self._lock:
+                job['status'] = 'cancelled' if cancel_event.is_set() else status
+                job['error'] = error
+                job['finished'] = time.time()
+                self._current = None
+
+    def _reap_idle_models(self):
+        while not self._stopped.wait(min(30, max(1, self.idle_timeout / 4))):
+            if self._current is None:
+                self.resources.unload_idle_models(self.idle_timeout)
+
+    def close(self):
+        self._stopped.set()
+        self._pending.put(None)
+        for job_id in list(self._cancel_events):
+            self._cancel_events[job_id].set()
+        self._worker.join(timeout=10)
+        self.resources.close()
+
+def start_daemon(port=5667, idle_timeout=300, queue_size=4):
+    """
+    Starts the generation daemon with a local HTTP API.
+    
+    Endpoints:
+        POST /jobs               - Queue a job (JSON: config, num_images, workflow, dimensions, steps, model)
+        GET  /jobs               - List jobs
+        GET  /jobs/<id>          - Job status
+        POST /jobs/<id>/cancel   - Cancel a queued or running job
+        GET  /status             - Loaded models, ComfyUI connections and the current job
+    """
+    try:
+        from flask import Flask, request, jsonify
+    except ImportError:
+        raise GenerationError("Flask is required for daemon mode (pip install flask).")
+
+    daemon = GenerationDaemon(idle_timeout, queue_size).start()
+    app = Flask(__name__)
+
+    @app.route('/jobs', methods=['POST'])
+    def api_submit():
+        try:
+            return jsonify(daemon.submit(request.get_json(force=True, silent=True) or {})), 202
+        except GenerationError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route('/jobs', methods=['GET'])
+    def api_jobs():
+        return jsonify({"jobs": daemon.list_jobs()})
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def api_job(job_id):
+        job = daemon.describe(job_id)
+        return (jsonify(job), 200) if job is not None else (jsonify({"error": "Unknown job"}), 404)
+
+    @app.route('/jobs/<job_id>/cancel', methods=['POST'])
+    def api_cancel(job_id):
+        job = daemon.cancel(job_id)
+        return (jsonify(job), 200) if job is not None else (jsonify({"error": "Unknown job"}), 404)
+
+    @app.route('/status', methods=['GET'])
+    def api_status():
+        return jsonify(daemon.status())
+
+    print_header("🌐 Imginarium Generation Daemon 🌐")
+    print_info(f"Listening on http://127.0.0.1:{port}")
+    print_info(f"Models are unloaded after {idle_timeout}s without jobs")
+    print_info("Press Ctrl+C to stop the daemon")
+    try:
+        app.run(host="127.0.0.1", port=port, debug=False, threaded=True)
+    finally:
+        daemon.close()
 
 # --- Validation ---
-def validate_workflow(workflow_str):
+def validate_workflow(workflow):
     """
-    Validates a workflow string to ensure it contains required placeholders.
+    Validates a workflow to ensure it contains required placeholders.
     
     Required placeholders:
     - {FILENAME_PREFIX}
@@ -565,24 +3577,27 @@ def validate_workflow(workflow_str):
     - {WIDTH}
     - {HEIGHT}
     
+    Args:
+        workflow (str or dict): Raw template text or a compiled template
+    
     Returns:
         tuple: (is_valid, list of missing required placeholders, list of missing recommended placeholders)
+        
+    Raises:
+        ValueError: If the template is not valid JSON
     """
+    compiled = compile_workflow(workflow) if isinstance(workflow, str) else workflow
+    present = {f"{{{name}}}" for name in compiled['placeholders']}
+
     # Define required and recommended placeholders
     required_placeholders = ["{FILENAME_PREFIX}", "{PROMPT}"]
     recommended_placeholders = ["{NEGATIVE_PROMPT}", "{STEPS}", "{SEED}", "{WIDTH}", "{HEIGHT}"]
     
     # Check for required placeholders
-    missing_required = []
-    for placeholder in required_placeholders:
-        if placeholder not in workflow_str:
-            missing_required.append(placeholder)
+    missing_required = [placeholder for placeholder in required_placeholders if placeholder not in present]
     
     # Check for recommended placeholders
-    missing_recommended = []
-    for placeholder in recommended_placeholders:
-        if placeholder not in workflow_str:
-            missing_recommended.append(placeholder)
+    missing_recommended = [placeholder for placeholder in recommended_placeholders if placeholder not in present]
     
     # Workflow is valid if no required placeholders are missing
     is_valid = len(missing_required) == 0
@@ -590,43 +3605,512 @@ def validate_workflow(workflow_str):
     return is_valid, missing_required, missing_recommended
 
 # --- Metadata ---
-def add_metadata_to_image(image_path, metadata):
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_TEXT_CHUNK_TYPES = (b'tEXt', b'zTXt', b'iTXt')
+
+def _png_chunk(chunk_type, data):
+    """Encodes a PNG chunk: length, type, data and CRC over type + data."""
+    crc = zlib.crc32(chunk_type + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', crc)
+
+def _png_text_chunk(key, value):
+    """Encodes a key/value pair as tEXt, or as uncompressed iTXt if the value is not Latin-1."""
+    keyword = key.encode('latin-1')
+    if not 1 <= len(keyword) <= 79:
+        raise ValueError(f"Invalid PNG text keyword: {key!r}")
+    try:
+        return _png_chunk(b'tEXt', keyword + b'\0' + value.encode('latin-1'))
+    except UnicodeEncodeError:
+        # keyword, compression flag + method, empty language tag and translated keyword
+        return _png_chunk(b'iTXt', keyword + b'\0\0\0\0\0' + value.encode('utf-8'))
+
+def _iter_png_chunks(png_bytes):
     """
-    Add metadata to a PNG image using text chunks.
+    Yields (chunk type, start, end) for every chunk of a PNG, up to and including IEND.
     
-    Args:
-        image_path (str): Path to the PNG image
-        metadata (dict): Dictionary of metadata to add to the image
+    Raises:
+        ValueError: If the bytes are not a well-formed PNG
+    """
+    if not png_bytes.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG image")
+    pos = len(PNG_SIGNATURE)
+    while pos < len(png_bytes):
+        if pos + 8 > len(png_bytes):
+            raise ValueError("Truncated PNG chunk header")
+        length, = struct.unpack('>I', png_bytes[pos:pos+4])
+        chunk_type = png_bytes[pos+4:pos+8]
+        end = pos + 12 + length
+        if end > len(png_bytes):
+            raise ValueError(f"Truncated PNG chunk: {chunk_type!r}")
+        yield chunk_type, pos, end
+        pos = end
+        if chunk_type == b'IEND':
+            break
+
+def png_content_digest(image_bytes):
+    """
+    SHA-256 of an image's pixel content, ignoring PNG text chunks.
+    
+    ComfyUI's SaveImage embeds the prompt JSON, including the per-job filename
+    prefix, so two identical renders never match byte for byte. Images that are
+    not PNGs are hashed whole.
     """
+    digest = hashlib.sha256()
     try:
-        # Check if file exists and is a PNG
-        if not os.path.exists(image_path):
-            print_error(f"Image not found: {image_path}")
-            return False
-            
-        if not image_path.lower().endswith('.png'):
-            print_warning(f"Metadata can only be added to PNG images: {image_path}")
-            return False
+        for chunk_type, start, end in _iter_png_chunks(image_bytes):
+            if chunk_type not in PNG_TEXT_CHUNK_TYPES:
+                digest.update(image_bytes[start:end])
+    except ValueError:
+        return hashlib.sha256(image_bytes).hexdigest()
+    return digest.hexdigest()
+
+def add_png_text_chunks(png_bytes, metadata):
+    """
+    Splices metadata into PNG bytes as text chunks, without decoding the image.
+    
+    The new chunks are inserted right after IHDR. Existing text chunks are
+    dropped, matching what a PIL re-save used to produce, while every other
+    chunk (including the pixel data) is copied through byte for byte.
+    
+    Args:
+        png_bytes (bytes): Encoded PNG image
+        metadata (dict): Dictionary of metadata to add; None values are skipped
         
-        # Open the image
-        img = Image.open(image_path)
+    Returns:
+        bytes: The PNG with the metadata chunks
+    """
+    text_chunks = [_png_text_chunk(key, str(value)) for key, value in metadata.items() if value is not None]
+    parts = [PNG_SIGNATURE]
+    inserted = False
+    for chunk_type, start, end in _iter_png_chunks(png_bytes):
+        if chunk_type not in PNG_TEXT_CHUNK_TYPES:
+            parts.append(png_bytes[start:end])
+        if chunk_type == b'IHDR' and not inserted:
+            parts.extend(text_chunks)
+            inserted = True
+
+    if not inserted:
+        raise ValueError("PNG is missing its IHDR chunk")
+    return b''.join(parts)
+
+def stage_file(path, data):
+    """
+    Writes data to a hidden temporary file next to path, without syncing it.
+    
+    Returns:
+        str: The temporary path; commit_staged_files() moves it into place
+    """
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+    except BaseException:
+        discard_staged_file(temp_path)
+        raise
+    return temp_path
+
+def discard_staged_file(temp_path):
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+
+def commit_staged_files(staged):
+    """
+    Fsyncs a batch of staged files, then renames each into place, so no reader sees a partial file.
+    
+    Every file is written before the first fsync, letting the disk flush the batch
+    together. Call fsync_directory() afterwards to make the renames durable.
+    
+    Args:
+        staged (list): (temporary path, final path) tuples from stage_file()
         
-        # Create a PngInfo object
-        meta = PngImagePlugin.PngInfo()
+    Returns:
+        set: Final paths that could not be committed; their temporary files are removed
+    """
+    failed = set()
+    for temp_path, path in staged:
+        try:
+            fd = os.open(temp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print_error(f"Error saving image {path}: {e}")
+            failed.add(path)
+    for temp_path, path in staged:
+        if path in failed:
+            discard_staged_file(temp_path)
+            continue
+        try:
+            os.replace(temp_path, path)
+        except OSError as e:
+            print_error(f"Error saving image {path}: {e}")
+            discard_staged_file(temp_path)
+            failed.add(path)
+    return failed
+
+def fsync_directory(directory):
+    """Makes renames into a directory durable; a no-op where directories cannot be opened (Windows)."""
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def stage_image_with_metadata(image_path, image_bytes, metadata, timings=None):
+    """
+    Writes PNG bytes to a staged temporary file exactly once, with metadata spliced in as text chunks.
+    commit_staged_files() then moves it into place atomically, so a crash never leaves a half-written image.
+    
+    Args:
+        image_path (str): Destination path
+        image_bytes (bytes): Encoded image as returned by ComfyUI
+        metadata (dict): Dictionary of metadata to add to the image
+        timings (dict): If given, seconds spent adding 'metadata' and on the disk 'write' are added to it
         
-        # Add metadata as text chunks
-        for key, value in metadata.items():
-            if value is not None:
-                # Convert any non-string values to strings
-                meta.add_text(key, str(value))
+    Returns:
+        str: The temporary path, or None if it could not be written
+    """
+    started = time.time()
+    try:
+        if image_path.lower().endswith('.png'):
+            image_bytes = add_png_text_chunks(image_bytes, metadata)
+        else:
+            print_warning(f"Metadata can only be added to PNG images: {image_path}")
+    except ValueError as e:
+        print_warning(f"Could not add metadata to {image_path}: {e}")
+    written = time.time()
+
+    try:
+        return stage_file(image_path, image_bytes)
+    except OSError as e:
+        print_error(f"Error saving image {image_path}: {e}")
+        return None
+    finally:
+        if timings is not None:
+            timings['metadata'] = timings.get('metadata', 0.0) + written - started
+            timings['write'] = timings.get('write', 0.0) + time.time() - written
+
+class ImageWriter:
+    """
+    Background writer for finished images, shared by every run that saves to one output directory.
+    
+    Jobs hand over their images with submit() and get a Future back, so the threads
+    receiving ComfyUI results never wait on the disk. Writer threads take queued jobs
+    in batches: every file of a batch is written to a temporary file, then all of
+    them are fsynced and renamed into place (see commit_staged_files) and the
+    directory is fsynced once. The SHA-256 of every image's pixel content (see
+    png_content_digest) is recorded in the SQLite index <output_dir>/.content_index.sqlite,
+    so identical renders are detected without holding every hash in memory; with
+    skip_duplicates they are not written again.
+    """
+
+    INDEX_NAME = ".content_index.sqlite"
+    LEGACY_INDEX_NAME = ".content_index.jsonl"
+
+    def __init__(self, output_dir, writers=2, batch_size=16, skip_duplicates=True):
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.skip_duplicates = skip_duplicates
+        self.duplicates = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # Hashes staged in a batch that has not been committed yet
+        self._pending = {}
+        os.makedirs(output_dir, exist_ok=True)
+        index_path = os.path.join(output_dir, self.INDEX_NAME)
+        created = not os.path.exists(index_path)
+        self._db = sqlite3.connect(index_path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS images (sha256 TEXT PRIMARY KEY, path TEXT NOT NULL)")
+        legacy_path = os.path.join(output_dir, self.LEGACY_INDEX_NAME)
+        if created and os.path.exists(legacy_path):
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue # A line cut short by a crash
+                    self._db.execute("INSERT OR IGNORE INTO images (sha256, path) VALUES (?, ?)",
+                                     (entry['sha256'], entry['path']))
+        self._db.commit()
+        self._threads = [threading.Thread(target=self._run, name=f"image-writer-{n}", daemon=True)
+                         for n in range(max(1, writers))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, files, metadata):
+        """
+        Queues one job's images for writing.
         
-        # Save the image with metadata
-        img.save(image_path, "PNG", pnginfo=meta)
-        print_info(f"Added metadata to image: {image_path}")
-        return True
-    except Exception as e:
-        print_error(f"Error adding metadata to image: {e}")
-        return False
+        Args:
+            files (list): (path, image bytes) tuples, or (path, image bytes, metadata) to add
+                          metadata to that image only
+            metadata (dict): Metadata added to every image
+            
+        Returns:
+            Future: Resolves to a dict with 'files' (the paths holding the images; for a skipped
+                    duplicate, the existing identical file), 'duplicates', 'metadata' (the
+                    per-image metadata by saved path) and 'timings'
+        """
+        future = Future()
+        self._queue.put((files, metadata, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Leave the stop marker for after this batch
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+
+    def _lookup(self, digest):
+        """Returns the path already holding an image with this digest, or None. Call with the lock held."""
+        path = self._pending.get(digest)
+        if path is None:
+            row = self._db.execute("SELECT path FROM images WHERE sha256 = ?", (digest,)).fetchone()
+            path = row[0] if row else None
+        return path
+
+    def _write_batch(self, batch):
+        staged = []
+        batch_paths = set()
+        finished = []
+        for files, metadata, future in batch:
+            result = {"files": [], "duplicates": [], "metadata": {}, "timings": {"metadata": 0.0, "write": 0.0}}
+            job_staged = []
+            try:
+                for path, image_bytes, *file_metadata in files:
+                    file_metadata = file_metadata[0] if file_metadata else {}
+                    digest = png_content_digest(image_bytes)
+                    with self._lock:
+                        existing = self._lookup(digest)
+                    if existing is not None and existing != path and (existing in batch_paths or os.path.exists(existing)):
+                        self.duplicates += 1
+                        if self.skip_duplicates:
+                            print_warning(f"{os.path.basename(path)} is identical to {existing}; not saved again")
+                            result['files'].append(existing)
+                            result['duplicates'].append(existing)
+                            result['metadata'][existing] = file_metadata
+                            continue
+                        print_warning(f"{os.path.basename(path)} is identical to {existing}")
+                    temp_path = stage_image_with_metadata(path, image_bytes, {**metadata, **file_metadata},
+                                                          result['timings'])
+                    if temp_path is not None:
+                        job_staged.append((temp_path, path, digest))
+                        result['files'].append(path)
+                        result['metadata'][path] = file_metadata
+                        with self._lock:
+                            self._pending.setdefault(digest, path)
+                        batch_paths.add(path)
+            except Exception as e:
+                for temp_path, _, _ in job_staged:
+                    discard_staged_file(temp_path)
+                future.set_exception(e)
+                continue
+            staged.extend(job_staged)
+            finished.append((future, result))
+
+        started = time.time()
+        failed = commit_staged_files([(temp_path, path) for temp_path, path, _ in staged])
+        for directory in {os.path.dirname(path) for _, path, _ in staged if path not in failed}:
+            fsync_directory(directory)
+        with self._lock:
+            for _, path, digest in staged:
+                if self._pending.get(digest) == path:
+                    del self._pending[digest]
+                if path not in failed:
+                    self._db.execute("INSERT OR IGNORE INTO images (sha256, path) VALUES (?, ?)", (digest, path))
+            self._db.commit()
+        synced = time.time() - started
+        for future, result in finished:
+            # Every job in the batch waited for the shared sync and renames
+            result['files'] = [path for path in result['files'] if path not in failed]
+            result['timings']['write'] += synced
+            future.set_result(result)
+
+    def close(self):
+        """Writes everything already queued, then stops the writer threads."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            self._db.close()
+
+_IMAGE_WRITERS = {}
+_IMAGE_WRITERS_LOCK = threading.Lock()
+
+def get_image_writer(comfy_config):
+    """Returns the ImageWriter for the config's output directory, starting it on first use."""
+    output_dir = comfy_config.get('output_directory')
+    with _IMAGE_WRITERS_LOCK:
+        writer = _IMAGE_WRITERS.get(output_dir)
+        if writer is None:
+            writer = ImageWriter(output_dir, int(comfy_config.get('image_writers', 2)))
+            _IMAGE_WRITERS[output_dir] = writer
+        writer.skip_duplicates = comfy_config.get('duplicate_images', 'skip') == 'skip'
+        return writer
+
+def close_image_writers():
+    with _IMAGE_WRITERS_LOCK:
+        writers = list(_IMAGE_WRITERS.values())
+        _IMAGE_WRITERS.clear()
+    for writer in writers:
+        writer.close()
+
+# --- Thumbnails ---
+THUMBNAIL_DIR = ".thumbs"
+DEFAULT_THUMBNAIL_SIZES = (256, 768)
+
+def thumbnail_path(image_path, size):
+    """Sidecar path of an image's thumbnail: <image dir>/.thumbs/<size>/<image name>.webp"""
+    directory, filename = os.path.split(image_path)
+    return os.path.join(directory, THUMBNAIL_DIR, str(size), os.path.splitext(filename)[0] + ".webp")
+
+def make_thumbnails(image_path, sizes, quality=80):
+    """
+    Writes a WebP thumbnail of an image for every size (longest side, never upscaled).
+    Runs in a ThumbnailPool worker process.
+    
+    Returns:
+        list: Paths of the written thumbnails
+    """
+    paths = []
+    with Image.open(image_path) as source:
+        image = source.convert("RGBA" if "A" in source.getbands() else "RGB")
+    # Largest first, so each smaller size is scaled down from the previous thumbnail
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, "WEBP", quality=quality, method=4)
+        path = thumbnail_path(image_path, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Thumbnails can be rebuilt from the image, so a rename without fsync is enough
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(temp_path, path)
+        paths.append(path)
+    return paths
+
+class ThumbnailPool:
+    """
+    Builds thumbnails of saved images on worker processes, so resizing and WebP
+    encoding never hold up downloads, disk writes or the next ComfyUI job.
+    """
+
+    def __init__(self, sizes=DEFAULT_THUMBNAIL_SIZES, workers=2, quality=80):
+        self.sizes = tuple(sizes)
+        self.quality = quality
+        self.built = 0
+        self.failed = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        # Forking a process that runs listener and writer threads can deadlock the children
+        self._executor = ProcessPoolExecutor(max_workers=max(1, workers),
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, image_path):
+        future = self._executor.submit(make_thumbnails, image_path, self.sizes, self.quality)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(lambda done, image_path=image_path: self._finished(done, image_path))
+        return future
+
+    def _finished(self, future, image_path):
+        with self._lock:
+            self._pending.discard(future)
+            if future.exception() is None:
+                self.built += 1
+                return
+            self.failed += 1
+        if isinstance(future.exception(), BrokenProcessPool):
+            discard_thumbnail_pool(self)
+        print_warning(f"Could not create thumbnails for {image_path}: {future.exception()}")
+
+    def wait(self):
+        """Blocks until every submitted image has its thumbnails."""
+        with self._lock:
+            pending = list(self._pending)
+        wait_for_futures(pending)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+_THUMBNAIL_POOL = None
+_THUMBNAIL_POOL_LOCK = threading.Lock()
+
+def get_thumbnail_pool(comfy_config):
+    """Returns the shared ThumbnailPool, or None if `thumbnail_sizes` is empty."""
+    global _THUMBNAIL_POOL
+    sizes = comfy_config.get('thumbnail_sizes', DEFAULT_THUMBNAIL_SIZES)
+    if not sizes:
+        return None
+    sizes = tuple(int(size) for size in sizes)
+    with _THUMBNAIL_POOL_LOCK:
+        if _THUMBNAIL_POOL is None:
+            _THUMBNAIL_POOL = ThumbnailPool(sizes, int(comfy_config.get('thumbnail_workers', 2)),
+                                            int(comfy_config.get('thumbnail_quality', 80)))
+        _THUMBNAIL_POOL.sizes = sizes
+        return _THUMBNAIL_POOL
+
+def discard_thumbnail_pool(pool):
+    """Drops a broken pool, so the next get_thumbnail_pool() starts fresh worker processes."""
+    global _THUMBNAIL_POOL
+    with _THUMBNAIL_POOL_LOCK:
+        if _THUMBNAIL_POOL is not pool:
+            return
+        _THUMBNAIL_POOL = None
+    pool._executor.shutdown(wait=False, cancel_futures=True)
+
+def submit_thumbnails(comfy_config, image_paths):
+    """
+    Queues thumbnails for saved images on the shared pool. A broken pool (a worker
+    process died) is replaced once; any other failure is only reported.
+    """
+    for attempt in range(2):
+        pool = None
+        try:
+            pool = get_thumbnail_pool(comfy_config)
+            if pool is None:
+                return
+            for image_path in image_paths:
+                pool.submit(image_path)
+            return
+        except BrokenProcessPool as e:
+            if pool is not None:
+                discard_thumbnail_pool(pool)
+            if attempt:
+                print_warning(f"Thumbnail workers keep failing; skipping thumbnails: {e}")
+        except Exception as e:
+            print_warning(f"Could not queue thumbnails: {e}")
+            return
+
+def close_thumbnail_pool():
+    """Finishes the thumbnails still being built and stops the worker processes."""
+    global _THUMBNAIL_POOL
+    with _THUMBNAIL_POOL_LOCK:
+        pool, _THUMBNAIL_POOL = _THUMBNAIL_POOL, None
+    if pool is not None:
+        pool.close()
 
 def read_metadata_from_image(image_path):
     """
@@ -677,6 +4161,9 @@ Examples:
   # Use a specific workflow
   python generate.py -n 2 -w flux_dev -c stock
   
+  # Render the same prompts through several workflows to compare them
+  python generate.py -n 4 -w sd_xl sd_xl_epicreal flux_dev -c stock
+  
   # Specify custom image dimensions
   python generate.py -n 2 -w flux_dev -d 1920x1080
   
@@ -685,142 +4172,148 @@ Examples:
   
   # Combine parameters
   python generate.py -n 5 -m "gemma-3-4b-it" -w flux_dev -d 1024x1024 -s 40
+  
+  # Render 4 variations of every prompt in one sampler batch
+  python generate.py -n 5 -c stock --variations 4
+  
+  # Render each prompt as soon as it is generated
+  python generate.py -n 500 -c stock --pipeline
+  
+  # Run as a daemon and queue jobs over HTTP
+  python generate.py --daemon 5667
+  curl -X POST localhost:5667/jobs -d '{"config": "stock", "num_images": 4}'
+  
+  # Generate a very large batch with flat memory and periodic progress lines
+  python generate.py -n 100000 -c stock --sampling unique --stream
+  
+  # Render a favourite again at a higher resolution, with 4 consecutive seeds
+  python generate.py -c stock --replay output/stock/flux_dev_portrait_00001_.png -d 2048x2048 --seeds 4
+  
+  # Re-render the newest 5 images matching a search with another workflow
+  python generate.py -c stock --replay-search "coffee morning" --replay-limit 5 -w sd_xl
+  
+  # Continue a run that was interrupted
+  python generate.py -c stock --resume 20250418_123456_ab12
 """
     )
     parser.add_argument("-n", "--num-images", type=int, default=5, help="Number of images to generate.")
     parser.add_argument("-m", "--model", type=str, help="LM Studio model to use (overrides config)")
-    parser.add_argument("-w", "--workflow", type=str, help="Workflow to use from the workflows directory (overrides config default)")
+    parser.add_argument("-w", "--workflow", type=str, nargs="+", help="Workflow(s) to use from the workflows directory; each prompt is rendered through every listed workflow (overrides config default)")
     parser.add_argument("-d", "--dimensions", type=str, help="Image dimensions in format WIDTHxHEIGHT (e.g., 1920x1080)")
     parser.add_argument("-s", "--steps", type=int, help="Number of diffusion steps for image generation (higher = better quality but slower)")
-    parser.add_argument("-c", "--config", type=str, required=True, help="Configuration file to use (e.g., stock, art)")
+    parser.add_argument("-c", "--config", type=str, help="Configuration file to use (e.g., stock, art); required unless running as a daemon")
+    parser.add_argument("--resume", type=str, metavar="RUN_ID", help="Resume an interrupted run from its journal in output/<config>/runs/")
+    parser.add_argument("--replay", type=str, nargs="+", metavar="IMAGE", help="Render existing images again from their embedded prompt, seed, steps, size and workflow, without LM Studio; -w, -d and -s override them")
+    parser.add_argument("--replay-search", type=str, metavar="QUERY", help="Replay the newest images of the config whose prompt or tags contain every word of QUERY")
+    parser.add_argument("--replay-limit", type=int, default=10, help="Maximum images picked by --replay-search (default: 10)")
+    parser.add_argument("--seeds", type=int, default=1, help="With --replay, render each image with this many consecutive seeds starting at its own (default: 1)")
     parser.add_argument("--noemoji", action="store_true", help="Disable emojis in output")
+    parser.add_argument("--sampling", choices=TAG_SAMPLING_MODES, help="How tag combinations are drawn: random, unique (no repeats), stratified (even tag coverage) or fill-gaps (skip combinations already in the output directory) (overrides config, default: random)")
+    parser.add_argument("--dedup", nargs='?', const=0.7, type=float, metavar="THRESHOLD", help="Request a new prompt when one is at least THRESHOLD similar (0-1) to a prompt in this run or the library (default: 0.7)")
+    parser.add_argument("--prompt-batch", type=int, help="Number of tag combinations sent to LM Studio per request (overrides config, default: 1)")
+    parser.add_argument("--prompt-cache", choices=["reuse", "fresh", "off"], help="Reuse cached prompts for known tag combinations, force fresh ones, or disable the cache (overrides config, default: fresh)")
+    parser.add_argument("--llm-concurrency", type=int, help="Number of parallel LM Studio requests (overrides config, default: 1)")
+    parser.add_argument("--variations", type=int, help="Images rendered per prompt in one ComfyUI sampler batch, each with its own BatchIndex metadata (overrides config, default: 1)")
+    parser.add_argument("--in-flight", type=int, help="Number of prompts to keep queued on ComfyUI at once (overrides config, default: 1)")
+    parser.add_argument("--queue-depth", type=int, help="Only queue a prompt while the ComfyUI server has fewer than this many prompts queued, including other clients' (overrides config, default: no limit)")
+    parser.add_argument("--ws-images", action="store_true", help="Receive finished images over the ComfyUI websocket instead of downloading them")
+    parser.add_argument("--pipeline", action="store_true", help="Stream each prompt to ComfyUI as soon as LM Studio produces it")
+    parser.add_argument("--stream", action="store_true", help="Draw tag combinations lazily and pipeline them, keeping memory flat for very large runs; prints a periodic progress line instead of per-image output")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines in --stream mode (default: 10)")
+    parser.add_argument("--metrics", type=str, metavar="FILE", help="Write the run's timing summary to FILE in Prometheus text format")
+    parser.add_argument("--daemon", nargs='?', const=5667, type=int, metavar="PORT", help="Run as a long-lived generation daemon with a local HTTP API (default port: 5667)")
+    parser.add_argument("--idle-timeout", type=int, default=300, help="Seconds without jobs before the daemon unloads LM Studio models (default: 300)")
+    parser.add_argument("--queue-size", type=int, default=4, help="Maximum prompts buffered between LM Studio and ComfyUI in pipeline mode (default: 4)")
     args = parser.parse_args()
 
     # Set global emoji flag
     set_emoji_mode(args.noemoji)
 
+    if args.daemon:
+        try:
+            start_daemon(args.daemon, args.idle_timeout, args.queue_size)
+        except KeyboardInterrupt:
+            print_info("Daemon stopped. Goodbye! 👋")
+        except GenerationError as e:
+            print_error(str(e))
+            sys.exit(1)
+        sys.exit(0)
+    if not args.config:
+        parser.error("the following arguments are required: -c/--config")
+
     print_header(f"🌟 Stock Image Generator 🌟")
-    print_info(f"Generating {args.num_images} images")
+    replaying = bool(args.replay or args.replay_search)
+    if not args.resume and not replaying:
+        print_info(f"Generating {args.num_images} images")
     if args.model:
         print_info(f"Using model override: {args.model}")
     
     try:
         # 1. Load Configuration
         config = load_config(os.path.join("configs", f"{args.config}.yaml"))
-        if not config:
-            exit(1)
-            
-        # Override the output directory to use output/{config_name}/
-        output_dir = os.path.join("output", args.config)
-        os.makedirs(output_dir, exist_ok=True)
-        config['comfy_ui']['output_directory'] = output_dir
-        
-        # Use default workflow from config if not specified
-        default_workflow = config.get('comfy_ui', {}).get('default_workflow', 'flux_dev')
-        workflow_name = args.workflow or default_workflow
-        print_info(f"Using workflow: {workflow_name} (from {'command line' if args.workflow else 'config'})")
-        
-        # Now check if workflow file exists (with or without .wf extension)
-        workflow_base_path = os.path.join("workflows", workflow_name)
-        workflow_wf_path = os.path.join("workflows", f"{workflow_name}.wf")
-        
-        workflow_path = None
-        if os.path.exists(workflow_wf_path):
-            workflow_path = workflow_wf_path
-            workflow_exists = True
-        elif os.path.exists(workflow_base_path):
-            workflow_path = workflow_base_path
-            workflow_exists = True
-        else:
-            workflow_exists = False
-        
-        if not workflow_exists:
-            print_error(f"Workflow file not found: {workflow_name}")
-            print_info(f"Make sure the workflow file exists in the 'workflows' directory (with or without .wf extension)")
-            exit(1)
-        
-        # Load and validate workflow
-        try:
-            with open(workflow_path, 'r') as f:
-                workflow_str = f.read()
-                
-            # Validate workflow for required and recommended placeholders
-            is_valid, missing_required, missing_recommended = validate_workflow(workflow_str)
-            
-            if not is_valid:
-                print_error(f"Workflow validation failed! Missing required placeholders: {', '.join(missing_required)}")
-                print_error("These placeholders are necessary for the workflow to function correctly.")
-                exit(1)
-                
-            if missing_recommended:
-                print_warning(f"Workflow is missing recommended placeholders: {', '.join(missing_recommended)}")
-                print_warning("The workflow will still run, but some features may not work as expected.")
-        except Exception as e:
-            print_error(f"Error loading or validating workflow: {e}")
-            exit(1)
-    
-        try:
-            # 2. Generate Tag Combinations
-            tag_combinations = generate_tag_combinations(config.get('tags', {}), args.num_images)
-            if not tag_combinations:
-                print_error("No tag combinations generated, exiting.")
-                exit(1)
-
-            # 3. Generate Prompts using LM Studio
-            detailed_prompts = generate_prompts_lm_studio(tag_combinations, config.get('lm_studio', {}), args.model)
-            if not detailed_prompts:
-                print_error("No prompts generated by LM Studio, exiting.")
-                exit(1)
-
-            # 4. Generate Images using ComfyUI
-            if args.dimensions:
-                try:
-                    if 'x' not in args.dimensions:
-                        raise ValueError("Size must be in format WIDTHxHEIGHT (e.g., 1920x1080)")
-                    width, height = map(int, args.dimensions.split('x'))
-                    if width <= 0 or height <= 0:
-                        raise ValueError("Width and height must be positive integers")
-                    print_info(f"Overriding image dimensions: {width}x{height}")
-                    config['comfy_ui']['width'] = width
-                    config['comfy_ui']['height'] = height
-                except ValueError as e:
-                    print_error(f"Invalid size format: {e}")
-                    sys.exit(1)
-            else:
-                width = config['comfy_ui'].get('width', 1536)
-                height = config['comfy_ui'].get('height', 1536)
-                print_info(f"Using dimensions from config: {width}x{height}")
-                
-            if args.steps:
-                print_info(f"Overriding steps count: {args.steps}")
-                config['comfy_ui']['steps'] = args.steps
-            else:
-                steps = config['comfy_ui'].get('steps', 35)
-                config['comfy_ui']['steps'] = steps
-                print_info(f"Using steps from config: {steps}")
-                
-            if args.model:
-                print_info(f"Using model override: {args.model}")
+
+        # 2. Apply sampling, LM Studio and ComfyUI overrides
+        if args.sampling:
+            print_info(f"Tag sampling mode: {args.sampling}")
+            config['tag_sampling'] = args.sampling
+
+        if args.prompt_batch:
+            print_info(f"Overriding LM Studio batch size: {args.prompt_batch}")
+            config['lm_studio']['batch_size'] = args.prompt_batch
+
+        if args.prompt_cache:
+            print_info(f"Prompt cache mode: {args.prompt_cache}")
+            config['lm_studio']['prompt_cache'] = args.prompt_cache
+
+        if args.dedup is not None:
+            print_info(f"Filtering near-duplicate prompts above {args.dedup:.0%} similarity")
+            config['lm_studio']['dedup_threshold'] = args.dedup
+
+        if args.llm_concurrency:
+            print_info(f"Overriding LM Studio concurrency: {args.llm_concurrency}")
+            config['lm_studio']['concurrency'] = args.llm_concurrency
+
+        if args.ws_images:
+            print_info("Receiving images over the ComfyUI websocket")
+
+        if args.variations:
+            print_info(f"Rendering {args.variations} variations per prompt")
+
+        if args.in_flight:
+            print_info(f"Overriding in-flight prompts: {args.in_flight}")
+            config['comfy_ui']['max_in_flight'] = args.in_flight
+        if args.queue_depth:
+            print_info(f"Overriding target queue depth: {args.queue_depth}")
+            config['comfy_ui']['target_queue_depth'] = args.queue_depth
+
+        # 3. Generate: images are saved to output/{config_name}/ as they finish
+        width, height = parse_dimensions(args.dimensions) if args.dimensions else (None, None)
+        with Generator(config, args.config, workflow=args.workflow, model=args.model, width=width, height=height,
+                       steps=args.steps, pipeline=args.pipeline, queue_size=args.queue_size,
+                       metrics_path=args.metrics, stream=args.stream,
+                       progress_interval=args.progress_interval, variations=args.variations,
+                       image_delivery='websocket' if args.ws_images else None) as generator:
+            if args.resume:
+                images = generator.resume(args.resume)
+            elif replaying:
+                images = generator.replay(args.replay or (), args.replay_search, args.seeds, args.replay_limit)
             else:
-                model = config['lm_studio'].get('model', 'gemma-3-4b-it')
-                print_info(f"Using model from config: {model}")
-                args.model = model
-                
-            generate_images_comfyui(detailed_prompts, config, tag_combinations, workflow_name)
-            
-            print_header("✨ All Done! ✨")
-            print_success("Check your output directory for the generated images!")
-            print_info("Thank you for using Stock Image Generator! 🙏")
-        except Exception as e:
-            print_error(f"An error occurred during image generation: {e}")
-            exit(1)
+                images = generator.generate(args.num_images)
+            for _ in images:
+                pass
+        
+        print_header("✨ All Done! ✨")
+        print_success("Check your output directory for the generated images!")
+        print_info("Thank you for using Stock Image Generator! 🙏")
     except KeyboardInterrupt:
         print("\n")
         print_warning("Process interrupted by user (Ctrl+C)")
         print_info("Exiting gracefully...")
-        # You could add any cleanup code here if needed
         print_info("Goodbye! 👋")
         sys.exit(130)  # Standard exit code for SIGINT
+    except GenerationError as e:
+        print_error(str(e))
+        sys.exit(1)
     except Exception as e:
         print_error(f"An unexpected error occurred: {e}")
         print_info("Exiting with error...")
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from generate import Generator, RunJournal
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def repo_cwd(monkeypatch):
+    # Workflows are looked up relative to the working directory
+    monkeypatch.chdir(REPO_DIR)
+
+
+def make_config():
+    return {
+        "comfy_ui": {"default_workflow": "flux_dev", "steps": 30, "width": 1024, "height": 1024},
+        "lm_studio": {"model": "gemma-3-4b-it"},
+    }
+
+
+def journal_run(tmp_path, **fields):
+    journal = RunJournal.create(str(tmp_path))
+    journal.record("run", run_id=journal.run_id, config="test", workflow=["flux_dev"], steps=30,
+                   width=1024, height=1024, num_images=8, **fields)
+    journal.close()
+    return RunJournal.replay(journal.path)
+
+
+def test_resume_restores_variations_and_image_delivery(tmp_path):
+    state = journal_run(tmp_path, variations=2, image_delivery="websocket")
+    generator = Generator(make_config(), "test", output_dir=str(tmp_path))
+    config, workflow_names, _ = generator._prepare(state['run'], llm=False)
+    assert workflow_names == ["flux_dev"]
+    assert config['comfy_ui']['variations'] == 2
+    assert config['comfy_ui']['image_delivery'] == "websocket"
+
+
+def test_explicit_arguments_win_over_the_journal(tmp_path):
+    state = journal_run(tmp_path, variations=2, image_delivery="http")
+    generator = Generator(make_config(), "test", output_dir=str(tmp_path), variations=4, image_delivery="websocket")
+    config, _, _ = generator._prepare(state['run'], llm=False)
+    assert config['comfy_ui']['variations'] == 4
+    assert config['comfy_ui']['image_delivery'] == "websocket"
+
+
+def test_journals_without_the_fields_use_the_config(tmp_path):
+    state = journal_run(tmp_path)
+    generator = Generator(make_config(), "test", output_dir=str(tmp_path))
+    config, _, _ = generator._prepare(state['run'], llm=False)
+    assert 'variations' not in config['comfy_ui']
+    assert 'image_delivery' not in config['comfy_ui']
+
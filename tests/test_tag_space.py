@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from generate import OPTIONAL_TAG_CATEGORIES, REQUIRED_TAG_CATEGORIES, TagSpace
+
+TAGS = {
+    "subject": list("abcdefghij"),
+    "action": list("abcde"),
+    "setting": list("abc"),
+    "mood": list("ab"),
+    "style": list("abcd"),
+    "lighting": list("abcdefghij"),
+    "camera_angle": list("abcde"),
+}
+
+
+@pytest.fixture
+def space():
+    random.seed(7)
+    return TagSpace(TAGS, REQUIRED_TAG_CATEGORIES, OPTIONAL_TAG_CATEGORIES)
+
+
+def inclusion_rates(space, indices):
+    combinations = [space.decode(index) for index in indices]
+    assert len(set(combinations)) == len(combinations)
+    return [sum(f"{category}:" in tags for tags in combinations) / len(combinations)
+            for category in OPTIONAL_TAG_CATEGORIES]
+
+
+@pytest.mark.parametrize("sampler", ["sample_unique", "sample_stratified"])
+def test_optional_categories_are_included_half_the_time(space, sampler):
+    for rate in inclusion_rates(space, getattr(space, sampler)(2000)):
+        assert 0.45 < rate < 0.55
+
+
+def test_iter_unique_walks_the_whole_space_once(space):
+    indices = list(space.iter_unique())
+    assert sorted(indices) == list(range(space.size))
+    for rate in inclusion_rates(space, indices[:2000]):
+        assert 0.45 < rate < 0.55
+
+
+def test_sample_unique_skips_excluded(space):
+    exclude = set(space.sample_unique(1000))
+    assert not exclude & set(space.sample_unique(500, exclude))